@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Time each step on a generated corpus to track regressions and scaling
+
+Generates index pages in the formats the sources use (PMLR, NIPS, and AAAI
+style links, including supplementary material to filter out), PDFs with some
+of the GAN, TL, and generative terms planted on the first pages, and pdfgrep
+output for many more papers than are downloaded. Then times:
+
+    links -- parsing and filtering the links of a large index page
+    plan -- fetching and parsing the index pages from a local HTTP server,
+        then again from the cache
+    download -- downloading the PDFs from the local server
+    extract -- extracting the text of the PDFs
+    match -- searching the text for the terms, from text.sqlite and then from
+        the memory-mapped corpus after packing it
+    chart -- generate_chart.py on the pdfgrep output
+
+It also checks that text was extracted and terms found, that searching only
+the changed terms gives the same matches as searching everything, and that
+the list of overlap papers is written, also when each has only one TL term.
+
+For each, prints the time, throughput, CPU time, and memory: how much the
+RSS of this process grew, or for the chart, the peak RSS of generate_chart.py,
+so each step's memory is its own rather than the largest of the steps so far
+(worker processes, e.g. when extracting, aren't included), e.g.
+
+    ./benchmark.py --papers 500 --grep-papers 100000 --output bench.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import functools
+import threading
+import subprocess
+import http.server
+import lxml.html
+
+import http_pool
+from metrics import cpuTime, currentMemory, maxrssBytes
+from manifest import Manifest
+from sources import Source, notSupplementary
+from download_pdfs import plan, downloadAll
+from extract_text import TextStore, extractAll, getBackend
+from match_terms import updateMatches, exportMatches, checkMatches, families
+from corpus_store import buildCorpus
+
+words = ("we propose a method for learning representations from data and show "
+    "that our approach outperforms previous work on several benchmarks using "
+    "deep neural networks trained with stochastic gradient descent").split()
+
+def makePDF(pages, padding=0):
+    """ Minimal PDF with one line of text per line of each page """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        ('<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join('%d 0 R' % (4+2*i)
+            for i in range(len(pages))), len(pages))).encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+
+    for i, text in enumerate(pages):
+        lines = [line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            for line in text.split('\n')]
+        stream = ('BT /F1 10 Tf 50 750 Td 12 TL ' + ' '.join("(%s) '" % line
+            for line in lines) + ' ET').encode()
+        objects.append(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            '/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (5+2*i)).encode())
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+
+    # Padding in a comment to make the file the size of a real paper
+    out = b'%PDF-1.4\n' + (b'%' + b'x'*padding + b'\n' if padding else b'')
+    offsets = []
+
+    for i, obj in enumerate(objects):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (i+1, obj)
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects)+1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects)+1, xref)
+
+    return out
+
+def plantedTerms(rng):
+    """ (family, spelling) of some of the terms, as a real paper might have """
+    found = []
+
+    for family, (terms, ignorecase) in families.items():
+        if rng.random() < 0.3:
+            found += [(family, spelling(rng, term)) for term, regex in rng.sample(
+                terms, min(len(terms), rng.randint(1, 3)))]
+
+    return found
+
+def spelling(rng, term):
+    if term == 'GAN':
+        return rng.choice(['generative adversarial networks', 'GANs', ' GAN,'])
+    return term
+
+def makePaperText(rng, pages=3, lines=40):
+    terms = plantedTerms(rng)
+    text = []
+
+    for page in range(pages):
+        text.append('\n'.join(' '.join(rng.choice(words) for _ in range(12))
+            for _ in range(lines)))
+
+    # Put each term somewhere in the first pages
+    for family, term in terms:
+        page = rng.randrange(pages)
+        text[page] += '\n' + term + ' ' + ' '.join(rng.choice(words) for _ in range(5))
+
+    return text
+
+def makeCorpus(outdir, papers=200, pages=3, padding=100000, seed=0):
+    """
+    Write the index pages and PDFs to serve to outdir, split between three
+    index page formats. Returns the number of PDFs.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(outdir, 'pmlr'), exist_ok=True)
+    os.makedirs(os.path.join(outdir, 'paper'), exist_ok=True)
+    os.makedirs(os.path.join(outdir, 'aaai', 'paper', 'download'), exist_ok=True)
+
+    pmlr, nips, aaai = [], [], []
+
+    for i in range(papers):
+        pdf = makePDF(makePaperText(rng, pages), padding)
+        kind = i % 3
+
+        if kind == 0:
+            name = 'pmlr/paper%d.pdf' % i
+            pmlr.append('<a href="%s">Download PDF</a>' % name)
+            pmlr.append('<a href="pmlr/paper%d-supp.pdf">Supplementary</a>' % i)
+        elif kind == 1:
+            name = 'paper/%d-a-paper-title.pdf' % i
+            nips.append('<li><a href="/paper/%d-a-paper-title">A Paper Title</a></li>' % i)
+        else:
+            name = 'aaai/paper/download/%d/%d' % (i, i+1000)
+            aaai.append('<a class="file" href="paper/view/%d/%d">PDF</a>' % (i, i+1000))
+            aaai.append('<a href="paper/view/%d">Abstract</a>' % i)
+
+        os.makedirs(os.path.dirname(os.path.join(outdir, name)), exist_ok=True)
+        with open(os.path.join(outdir, name), 'wb') as f:
+            f.write(pdf)
+
+    for name, links in [('pmlr.html', pmlr), ('nips.html', nips),
+            ('aaai/index.html', aaai)]:
+        with open(os.path.join(outdir, name), 'w') as f:
+            f.write('<html><body>\n' + '\n'.join(links) + '\n</body></html>\n')
+
+    return papers
+
+def makeIndexPage(links=50000, seed=0):
+    """ A large PMLR-style index page, a third of the links supplementary """
+    rng = random.Random(seed)
+    items = []
+
+    for i in range(links):
+        if i % 3 == 2:
+            items.append('<a href="paper%d-supp.pdf">Supplementary</a>' % i)
+        else:
+            items.append('<div class="paper"><p class="title">%s</p>'
+                '<a href="paper%d.pdf">Download PDF</a></div>' % (
+                ' '.join(rng.choice(words) for _ in range(8)), i))
+
+    return ('<html><body>\n' + '\n'.join(items) + '\n</body></html>\n').encode()
+
+def makeGrep(outdir, papers=100000, seed=0):
+    """ pdfgrep -Z output for the three families as grep_pdfs.sh writes """
+    rng = random.Random(seed)
+    os.makedirs(outdir, exist_ok=True)
+    venues = ['ICML', 'NIPS', 'CVPR', 'AAAI', 'IJCAI']
+    outputs = dict((family, open(os.path.join(outdir, family+'.txt'), 'w'))
+        for family in families)
+    matches = 0
+
+    for i in range(papers):
+        fname = 'pdfs/%s_%d_paper%d.pdf' % (rng.choice(venues), rng.randint(2014, 2018), i)
+
+        for family, term in plantedTerms(rng):
+            for _ in range(rng.randint(1, 5)):
+                # GAN output is whole lines, the others only the match (-o)
+                line = ('We use %s for this' % term.strip()) if family == 'gan' else term
+                outputs[family].write(fname + '\x00' + line + '\n')
+                matches += 1
+
+    for output in outputs.values():
+        output.close()
+
+    return matches
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+def serve(directory):
+    """ Serve a directory on a free port in the background """
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed(name, unit, fn):
+    """
+    Run fn, which returns how many units it processed, and report it. If it
+    runs a script, it returns (count, peak RSS in bytes of the script).
+    """
+    cpu = cpuTime()
+    memory = currentMemory()
+    start = time.perf_counter()
+    count = fn()
+    seconds = time.perf_counter() - start
+
+    if isinstance(count, tuple):
+        count, rss = count
+    else:
+        rss = currentMemory() - memory if memory is not None else 0
+
+    rss /= 1024*1024
+
+    result = {
+        'name': name,
+        'count': count,
+        'unit': unit,
+        'seconds': seconds,
+        'rate': count/seconds if seconds > 0 else None,
+        'cpu': cpuTime() - cpu,
+        'memory': rss,
+    }
+
+    # Some counts are fractional, e.g. MiB
+    print("%-18s %10s %-8s %8.2f s %12s %8.2f s cpu %8.1f MiB" % (
+        name, "%.1f" % count if isinstance(count, float) else count, unit, seconds,
+        "%.1f/s" % result['rate'] if result['rate'] is not None else '-',
+        result['cpu'], rss))
+
+    return result
+
+def benchLinks(data, repeat=3):
+    source = Source('ICML', {2018: 'http://localhost/'}, include=r'\.pdf',
+        exclude=notSupplementary)
+    count = 0
+
+    for i in range(repeat):
+        links = [str(link) for link in lxml.html.fromstring(data).xpath(source.search)]
+        count += len(source.papers(2018, 'http://localhost/', links))
+
+    return count
+
+def runChart(directory):
+    """ Run generate_chart.py in directory, returning its peak RSS in bytes """
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), 'generate_chart.py')], cwd=directory,
+        stdout=subprocess.DEVNULL)
+
+    # Its own resource usage rather than the largest of all the children
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+    return maxrssBytes(usage)
+
+def benchChart(directory, rows):
+    """ Run generate_chart.py on the rows of pdfgrep output in directory/grep """
+    return rows, runChart(directory)
+
+def checkOverlap(directory):
+    """
+    Run generate_chart.py on pdfgrep output where each GAN paper has only one
+    TL term and return the lines of list/overlap.txt
+    """
+    os.makedirs(os.path.join(directory, 'grep'), exist_ok=True)
+    papers = [('pdfs/ICML_2018_a.pdf', 'domain adaptation'),
+        ('pdfs/NIPS_2017_b.pdf', 'transfer learning')]
+
+    for family, lines in [
+            ('gan', [fname + '\x00We use GANs for this' for fname, term in papers]),
+            ('tl', [fname + '\x00' + term for fname, term in papers]),
+            ('generative', [])]:
+        with open(os.path.join(directory, 'grep', family+'.txt'), 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    runChart(directory)
+
+    with open(os.path.join(directory, 'list', 'overlap.txt'), 'r') as f:
+        return f.read().splitlines()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time each step on a generated corpus")
+    parser.add_argument('--papers', type=int, default=200,
+        help="PDFs to generate, download, extract, and search (default 200)")
+    parser.add_argument('--pdf-size', type=int, default=100, metavar='KiB',
+        help="approximate size of each PDF (default 100 KiB)")
+    parser.add_argument('--links', type=int, default=50000,
+        help="links on the index page for the link parsing benchmark (default 50000)")
+    parser.add_argument('--grep-papers', type=int, default=100000,
+        help="papers in the pdfgrep output for the chart (default 100000)")
+    parser.add_argument('--pages', type=int, default=3,
+        help="pages per PDF (default 3)")
+    parser.add_argument('--threads-per-host', type=int, default=4,
+        help="download threads per host (default 4)")
+    parser.add_argument('--processes', type=int, default=None,
+        help="PDFs to extract at once (default: number of cores)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dir', default=None,
+        help="generate and keep everything here rather than in a temporary directory")
+    parser.add_argument('--output', default=None,
+        help="append the results as a line of JSON to this file")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.dir or tempfile.mkdtemp(prefix='benchmark-'))
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+
+    # The scripts use paths relative to the current directory, e.g. pdfs/
+    os.chdir(workdir)
+
+    try:
+        print("Generating corpus in", workdir)
+        www = os.path.join(workdir, 'www')
+        makeCorpus(www, args.papers, args.pages, args.pdf_size*1024, args.seed)
+        index = makeIndexPage(args.links, args.seed)
+        matches = makeGrep(os.path.join(workdir, 'chart', 'grep'), args.grep_papers, args.seed)
+
+        # Two servers, so they count as different hosts for the per-host queues
+        servers = [serve(www), serve(www)]
+        urls = ['http://127.0.0.1:%d/' % s.server_address[1] for s in servers]
+        sources = [
+            Source('PMLR', {2018: urls[0] + 'pmlr.html'}, include=r'\.pdf',
+                exclude=notSupplementary),
+            Source('NIPS', {2018: urls[0] + 'nips.html'}, include=r'/paper',
+                urlSuffix='.pdf'),
+            Source('AAAI', {2018: urls[1] + 'aaai/index.html'},
+                search="//a[contains(@class, 'file')]/@href", include=r'paper/view',
+                rewrite=(r'paper/view', 'paper/download'), fnameSuffix='.pdf'),
+        ]
+        http_pool.configure(poolSize=args.threads_per_host)
+
+        print("%-18s %10s %-8s %10s %12s %14s %12s" % ('step', 'count', 'unit',
+            'time', 'rate', 'cpu', 'memory'))
+
+        results = []
+        toDownload = []
+
+        def planAll():
+            toDownload[:] = plan(sources, 'pdfs')
+            return len(toDownload)
+
+        results.append(timed('links', 'links', lambda: benchLinks(index)))
+        results.append(timed('plan', 'papers', planAll))
+        results.append(timed('plan (cached)', 'papers', planAll))
+
+        os.makedirs('pdfs', exist_ok=True)
+        manifest = Manifest('manifest.sqlite')
+        manifest.add(toDownload, 'pdfs')
+
+        def download():
+            downloadAll(manifest.pending(), manifest, args.threads_per_host, rate=0)
+            return sum(os.path.getsize(os.path.join('pdfs', f))
+                for f in os.listdir('pdfs'))/1024/1024
+
+        results.append(timed('download', 'MiB', download))
+        manifest.close()
+
+        results.append(timed('extract', 'PDFs', lambda: extractAll('pdfs',
+            'text.sqlite', args.pages, args.processes, progress=False)[1]))
+
+        store = TextStore('text.sqlite')
+        extracted = sum(any(page.strip() for page in text)
+            for fname, h, text in store.items())
+        store.close()
+        assert extracted > 0, "no text was extracted from any of the PDFs"
+        results.append(timed('match', 'PDFs', lambda: updateMatches('text.sqlite',
+            'matches.sqlite', args.pages, full=True)))
+        results.append(timed('corpus', 'MiB', lambda: buildCorpus('text.sqlite',
+            'corpus', args.pages)[2]/1024/1024))
+        results.append(timed('match (corpus)', 'PDFs', lambda: updateMatches(
+            'text.sqlite', 'matches.sqlite', args.pages, full=True,
+            corpusFile='corpus', processes=args.processes)))
+
+        # As if a TL term were added, so only that family is searched again,
+        # which has to give the same matches as searching everything
+        edited = dict(families)
+        edited['tl'] = (families['tl'][0] + [('zero-shot learning',
+            r'zero[-\ ]shot learning')], families['tl'][1])
+
+        results.append(timed('match (one family)', 'PDFs', lambda: updateMatches(
+            'text.sqlite', 'matches.sqlite', args.pages, edited,
+            corpusFile='corpus', processes=args.processes)))
+
+        missing, extra = checkMatches('text.sqlite', 'matches.sqlite', args.pages,
+            edited, 'corpus', args.processes)
+        assert not missing and not extra, \
+            "searching one family gave different matches than searching everything"
+
+        results.append(timed('export', 'matches', lambda: exportMatches(
+            'matches.sqlite', 'grep')))
+        assert results[-1]['count'] > 0, "no terms were found in any of the PDFs"
+
+        results.append(timed('chart', 'rows', lambda: benchChart(
+            os.path.join(workdir, 'chart'), matches)))
+
+        with open(os.path.join(workdir, 'chart', 'list', 'overlap.txt'), 'r') as f:
+            assert f.read().strip(), "no GAN papers with TL terms in the chart's lists"
+
+        assert checkOverlap(os.path.join(workdir, 'overlap')) == [
+            'pdfs/ICML_2018_a.pdf\tdomain adaptation',
+            'pdfs/NIPS_2017_b.pdf\ttransfer learning'], \
+            "wrong overlap list when each paper has one TL term"
+
+        for server in servers:
+            server.shutdown()
+
+        if output is not None:
+            with open(output, 'a') as f:
+                f.write(json.dumps({
+                    'time': time.time(),
+                    'backend': getBackend(),
+                    'params': vars(args),
+                    'results': results,
+                }) + '\n')
+    finally:
+        os.chdir(cwd)
+
+        if args.dir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tables and charts of paper counts by venue, year, and term
+
+Reads the counts generate_chart.py saves in list/cube.csv (papers by venue,
+year, family, and term) rather than the pdfgrep output, so any number of
+breakdowns can be made quickly. Families are gan, tl, generative, gan+tl (GAN
+papers with TL terms), gan+generative, and all (all the PDFs). The term * is
+papers with any of the family's terms. For example:
+
+    ./breakdown.py gan+tl
+    ./breakdown.py gan+tl --venue CVPR --venue NIPS --percent-of gan --plot gan_tl
+    ./breakdown.py tl --rows term --columns year
+"""
+import os
+import argparse
+import pandas as pd
+
+from generate_chart import pyplot
+
+dimensions = {'venue': 'Venue', 'year': 'Year', 'term': 'Term'}
+
+def readCube(listdir='list'):
+    """
+    The cube saved by generate_chart.py, from Parquet if it's at least as new
+    as the CSV, which is saved every time while Parquet only with --parquet
+    """
+    parquet = os.path.join(listdir, 'cube.parquet')
+    csv = os.path.join(listdir, 'cube.csv')
+
+    if os.path.exists(parquet) and (not os.path.exists(csv)
+            or os.stat(parquet).st_mtime_ns >= os.stat(csv).st_mtime_ns):
+        return pd.read_parquet(parquet)
+
+    return pd.read_csv(csv, keep_default_na=False,
+        na_values={'Year': ['']}, dtype={'Venue': str, 'Year': 'Int64',
+        'Family': str, 'Term': str, 'Papers': int})
+
+def breakdown(cube, family, rows='venue', columns='year', term='*',
+        venues=None, years=None):
+    """
+    Table of the number of papers of the family by rows and columns (venue,
+    year, or term), summed over the others. Only includes the given term
+    unless rows or columns is term, in which case it's each term.
+    """
+    df = cube[cube['Family'] == family]
+
+    if 'term' in (rows, columns):
+        df = df[df['Term'] != '*']
+    else:
+        df = df[df['Term'] == term]
+
+    if venues is not None:
+        df = df[df['Venue'].str.upper().isin([v.upper() for v in venues])]
+    if years is not None:
+        df = df[df['Year'].isin(years)]
+
+    index = dimensions[rows]
+    if columns is None:
+        return df.groupby(index)['Papers'].sum()
+
+    return df.pivot_table(index=index, columns=dimensions[columns],
+        values='Papers', aggfunc='sum', fill_value=0)
+
+def percentOf(table, cube, family, rows='venue', columns='year', venues=None,
+        years=None):
+    """ Table as a percentage of the papers of another family, e.g. gan """
+    dims = [d for d in (rows, columns) if d is not None and d != 'term']
+
+    if not dims:
+        total = breakdown(cube, family, 'venue', None, venues=venues,
+            years=years).sum()
+        return 100*table/total
+
+    total = breakdown(cube, family, dims[0], dims[1] if len(dims) > 1 else None,
+        venues=venues, years=years)
+
+    if len(dims) == 2:
+        return 100*table.div(total).reindex_like(table)
+    elif rows == dims[0]:
+        return 100*table.div(total, axis=0)
+    else:
+        return 100*table.div(total, axis=1)
+
+def plotTable(table, title, ylabel, save_name):
+    """ Lines over the years if years are the columns, otherwise bars """
+    plt = pyplot()
+
+    if hasattr(table, 'columns') and table.columns.name == 'Year':
+        table = table.T
+
+    if table.index.name == 'Year':
+        ax = table.plot(marker='o', figsize=(8, 4))
+        ax.set_xticks(list(table.index))
+    else:
+        ax = table.plot.bar(figsize=(8, 4))
+
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    plt.savefig(save_name+'.png', bbox_inches='tight')
+    plt.savefig(save_name+'.pdf', bbox_inches='tight')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Paper counts by venue, year, and term from list/cube.csv")
+    parser.add_argument('family', nargs='?', default='gan+tl',
+        help="gan, tl, generative, gan+tl, gan+generative, or all (default gan+tl)")
+    parser.add_argument('--rows', default='venue', choices=dimensions.keys(),
+        help="what each row is (default venue)")
+    parser.add_argument('--columns', default='year', choices=dimensions.keys(),
+        help="what each column is (default year)")
+    parser.add_argument('--term', default='*',
+        help="only this term, unless rows or columns are terms (default *, any term)")
+    parser.add_argument('--venue', action='append', default=None,
+        help="only this venue (may be repeated)")
+    parser.add_argument('--year', action='append', type=int, default=None,
+        help="only this year (may be repeated)")
+    parser.add_argument('--percent-of', default=None, metavar='FAMILY',
+        help="show as a percentage of the papers of this family, e.g. gan")
+    parser.add_argument('--plot', default=None, metavar='NAME',
+        help="also save a chart as NAME.png and NAME.pdf")
+    args = parser.parse_args()
+
+    if args.rows == args.columns:
+        parser.error("rows and columns must be different")
+
+    pd.options.display.max_rows = None
+    pd.options.display.max_columns = None
+    pd.options.display.width = None
+
+    cube = readCube('list')
+
+    if args.family not in set(cube['Family']):
+        parser.error("unknown family " + args.family + ", choose from: "
+            + ", ".join(sorted(set(cube['Family']))))
+
+    table = breakdown(cube, args.family, args.rows, args.columns, args.term,
+        args.venue, args.year)
+    ylabel = "Papers"
+
+    if args.percent_of is not None:
+        table = percentOf(table, cube, args.percent_of, args.rows, args.columns,
+            args.venue, args.year).round(1)
+        ylabel = "% of " + args.percent_of + " papers"
+
+    print(table.to_string())
+
+    if args.plot is not None:
+        title = args.family + ('' if 'term' in (args.rows, args.columns)
+            or args.term == '*' else ': ' + args.term)
+        plotTable(table, title, ylabel, args.plot)
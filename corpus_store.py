@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Extracted text of all the papers packed into one memory-mapped file
+
+Rather than decompressing each paper's text from text.sqlite, build once from
+it:
+
+    corpus.bin -- the UTF-8 text of every page of every paper, one after the
+        other, each page followed by a form feed
+    corpus.idx -- arrays of where each page starts in corpus.bin, the first
+        page of each paper, and each paper's year and venue
+    corpus.json -- the filename, hash, and extraction version of each paper
+        and the list of venues
+
+Both .bin and .idx are memory-mapped, so searching the text is a bytes regex
+over the mmap without copying or decoding it, and worker processes each map
+the same files (shared by the OS page cache) rather than being sent the text.
+Only the byte ranges to search are sent to the workers.
+
+    ./corpus_store.py
+"""
+import os
+import re
+import json
+import mmap
+import struct
+import bisect
+import argparse
+from array import array
+from multiprocessing import Pool
+
+from sources import parseFilename
+from extract_text import TextStore
+
+magic = b'CORPUS1\x00'
+header = struct.Struct('<8sQQ') # magic, number of papers, number of pages
+
+def writeAtomic(filename, write):
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, filename)
+
+def buildCorpus(storeFile='text.sqlite', corpusFile='corpus', pages=3):
+    """ Pack the first pages of each paper in storeFile. Returns the sizes. """
+    store = TextStore(storeFile)
+    versions = dict((fname, (h, version)) for fname, h, version in store.files())
+
+    pageStarts = array('Q', [0])
+    firstPages = array('I', [0])
+    years = array('H')
+    venueIds = array('H')
+    venues = {}
+    meta = {'pages': pages, 'files': [], 'sha256': [], 'versions': []}
+
+    with open(corpusFile + '.bin.tmp', 'wb') as f:
+        for fname, h, text in store.items():
+            venue, year = parseFilename(fname)
+
+            meta['files'].append(fname)
+            meta['sha256'].append(h)
+            meta['versions'].append(versions[fname][1])
+            years.append(year or 0)
+            venueIds.append(venues.setdefault(venue or '', len(venues)))
+
+            for page in text[:pages]:
+                data = page.encode('utf-8') + b'\f'
+                f.write(data)
+                pageStarts.append(pageStarts[-1] + len(data))
+
+            firstPages.append(len(pageStarts) - 1)
+
+    store.close()
+
+    def writeIndex(f):
+        f.write(header.pack(magic, len(years), len(pageStarts) - 1))
+        for a in (pageStarts, firstPages, years, venueIds):
+            a.tofile(f)
+
+    meta['venues'] = sorted(venues, key=venues.get)
+
+    os.replace(corpusFile + '.bin.tmp', corpusFile + '.bin')
+    writeAtomic(corpusFile + '.idx', writeIndex)
+    writeAtomic(corpusFile + '.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+    return len(years), len(pageStarts) - 1, pageStarts[-1]
+
+class Corpus:
+    """ Read-only view of a corpus made with buildCorpus() """
+    def __init__(self, corpusFile='corpus'):
+        with open(corpusFile + '.json', 'rb') as f:
+            meta = json.loads(f.read().decode('utf-8'))
+
+        self.pages = meta['pages']
+        self.files = meta['files']
+        self.sha256 = meta['sha256']
+        self.versions = meta['versions']
+        self.venueNames = meta['venues']
+        self.ids = dict((fname, i) for i, fname in enumerate(self.files))
+
+        self.text = self.map(corpusFile + '.bin')
+        self.index = self.map(corpusFile + '.idx')
+        self.view = index = memoryview(self.index)
+
+        _, numDocs, numPages = header.unpack_from(index)
+        assert numDocs == len(self.files), "corpus.idx doesn't match corpus.json, build again"
+
+        # Arrays directly in the mmap, no copies
+        pos = header.size
+        self.pageStarts, pos = self.cast(index, pos, 'Q', numPages + 1)
+        self.firstPages, pos = self.cast(index, pos, 'I', numDocs + 1)
+        self.years, pos = self.cast(index, pos, 'H', numDocs)
+        self.venues, pos = self.cast(index, pos, 'H', numDocs)
+
+    @staticmethod
+    def map(filename):
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def cast(buf, pos, fmt, count):
+        end = pos + count*struct.calcsize(fmt)
+        return buf[pos:end].cast(fmt), end
+
+    def __len__(self):
+        return len(self.files)
+
+    def venue(self, doc):
+        return self.venueNames[self.venues[doc]] or None
+
+    def year(self, doc):
+        return self.years[doc] or None
+
+    def current(self, filename, sha256, version):
+        """ Doc id of the file if its text in the corpus is up to date, else None """
+        doc = self.ids.get(filename)
+
+        if doc is not None and self.sha256[doc] == sha256 and self.versions[doc] == version:
+            return doc
+
+        return None
+
+    def span(self, doc):
+        """ Byte range in the text of all the pages of the doc """
+        return self.pageStarts[self.firstPages[doc]], self.pageStarts[self.firstPages[doc+1]]
+
+    def getPages(self, doc):
+        """ List of the text of each page """
+        first, last = self.firstPages[doc], self.firstPages[doc+1]
+        return [bytes(self.text[self.pageStarts[p]:self.pageStarts[p+1]-1]).decode('utf-8')
+            for p in range(first, last)]
+
+    def locate(self, pos):
+        """ (doc, page starting at 1, character offset in the page) of a byte position """
+        page = bisect.bisect_right(self.pageStarts, pos) - 1
+        doc = bisect.bisect_right(self.firstPages, page) - 1
+        start = self.pageStarts[page]
+        prefix = self.text[start:pos]
+
+        # Only decode when needed since ASCII bytes are characters
+        offset = len(prefix) if prefix.isascii() else len(prefix.decode('utf-8', 'replace'))
+
+        return doc, page - self.firstPages[doc] + 1, offset
+
+    def ranges(self, docs, size=8*1024*1024):
+        """
+        Byte ranges covering the docs, merging adjacent ones up to size bytes,
+        to split the search between processes
+        """
+        ranges = []
+
+        for doc in sorted(docs):
+            start, end = self.span(doc)
+
+            if ranges and ranges[-1][1] == start and end - ranges[-1][0] <= size:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+
+        return ranges
+
+    def close(self):
+        # Views into the mmaps have to be released before closing them
+        for a in (self.pageStarts, self.firstPages, self.years, self.venues, self.view):
+            a.release()
+
+        for m in (self.text, self.index):
+            if isinstance(m, mmap.mmap):
+                m.close()
+
+# Each worker process maps the corpus once
+workerCorpus = None
+workerRegexes = {}
+
+def initWorker(corpusFile):
+    global workerCorpus
+    workerCorpus = Corpus(corpusFile)
+
+def scanRange(args):
+    """ Run in the worker processes, returning (doc, page, offset, group name) """
+    pattern, start, end = args
+
+    if pattern not in workerRegexes:
+        workerRegexes[pattern] = re.compile(pattern)
+
+    return [workerCorpus.locate(m.start()) + (m.lastgroup,)
+        for m in workerRegexes[pattern].finditer(workerCorpus.text, start, end)]
+
+def scan(corpus, corpusFile, pattern, docs, processes=None, chunkSize=8*1024*1024):
+    """
+    Find the bytes regex pattern in the docs, returning a list of (doc, page,
+    offset, group name). Searched in parallel in chunks of about chunkSize
+    bytes unless processes=1.
+    """
+    ranges = corpus.ranges(docs, chunkSize)
+
+    if processes == 1 or len(ranges) <= 1:
+        regex = re.compile(pattern)
+        return [corpus.locate(m.start()) + (m.lastgroup,)
+            for start, end in ranges for m in regex.finditer(corpus.text, start, end)]
+
+    tasks = [(pattern, start, end) for start, end in ranges]
+
+    results = []
+
+    with Pool(processes, initWorker, (corpusFile,)) as pool:
+        for found in pool.imap_unordered(scanRange, tasks):
+            results += found
+
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack the extracted text into corpus.bin for fast searching")
+    parser.add_argument('--pages', type=int, default=3,
+        help="pages of each paper to include (default 3)")
+    args = parser.parse_args()
+
+    papers, pages, size = buildCorpus('text.sqlite', 'corpus', args.pages)
+    print("Papers:", papers, "Pages:", pages, "Size: %.1f MiB" % (size/1024/1024))
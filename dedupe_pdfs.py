@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Remove duplicate PDFs that were downloaded from different URLs
+
+New downloads are deduplicated as they're downloaded, but this finds the
+duplicates already in pdfs/. Each file is hashed (reusing hashes from the
+manifest when the size matches), the first file with each hash is kept, and
+the rest are deleted and recorded in the manifest as aliases of it.
+"""
+import os
+import argparse
+from multiprocessing import Pool
+from tqdm import tqdm # progress bar
+
+from manifest import Manifest, sha256sum
+
+def hashFile(fname):
+    return fname, os.path.getsize(fname), sha256sum(fname)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Remove duplicate PDFs")
+    parser.add_argument('--dry-run', action='store_true',
+        help="only print the duplicates")
+    parser.add_argument('--processes', type=int, default=None,
+        help="files to hash at once (default: number of cores)")
+    args = parser.parse_args()
+
+    downloaddir = 'pdfs'
+    manifestFile = 'manifest.sqlite'
+
+    manifest = Manifest(manifestFile)
+    known = manifest.hashes()
+
+    files = sorted(entry.path for entry in os.scandir(downloaddir)
+        if entry.is_file() and entry.name.endswith('.pdf'))
+
+    # Only hash the ones we don't already know the hash of
+    hashes = {}
+    toHash = []
+
+    for fname in files:
+        if fname in known and known[fname][0] == os.path.getsize(fname):
+            hashes[fname] = known[fname]
+        else:
+            toHash.append(fname)
+
+    with Pool(args.processes) as pool:
+        for fname, size, h in tqdm(pool.imap_unordered(hashFile, toHash, chunksize=16),
+                total=len(toHash)):
+            hashes[fname] = (size, h)
+
+    # Keep the first one (sorted by name) of each
+    duplicates = 0
+    saved = 0
+    first = {}
+
+    for fname in files:
+        size, h = hashes[fname]
+
+        if args.dry_run:
+            canonical = first.setdefault(h, fname)
+            canonical = canonical if canonical != fname else None
+        else:
+            canonical = manifest.duplicateOf(fname, h, size)
+
+        if canonical is not None:
+            print("Duplicate of", canonical, "-", fname)
+            duplicates += 1
+            saved += size
+
+            if not args.dry_run:
+                os.remove(fname)
+
+    print("Duplicates:", duplicates, "(%.1f MiB)" % (saved/1024/1024))
+    manifest.close()
@@ -3,138 +3,244 @@
 Script to download a whole bunch of ML and AI papers from 2014-2018
 """
 import os
-import re
 import json
 import time
+import queue
 import random
+import argparse
+import threading
+import http.client
 import lxml.html
-import urllib.request
 import urllib.error
-from hashlib import md5
-from urllib.parse import urlparse, urljoin
+from hashlib import md5, sha256
+from urllib.parse import urlparse
 from tqdm import tqdm # progress bar
+from concurrent.futures import ThreadPoolExecutor
 
-# Conferences with links to .pdf on their webpages
-conferences_easy = {
-    'ICML': {
-        2014: 'http://proceedings.mlr.press/v32/',
-        2015: 'http://proceedings.mlr.press/v37/',
-        2016: 'http://proceedings.mlr.press/v48/',
-        2017: 'http://proceedings.mlr.press/v70/',
-        2018: 'http://proceedings.mlr.press/v80/'
-    },
-    'AISTATS': {
-        2014: 'http://proceedings.mlr.press/v33/',
-        2015: 'http://proceedings.mlr.press/v38/',
-        2016: 'http://proceedings.mlr.press/v51/',
-        2017: 'http://proceedings.mlr.press/v54/',
-        2018: 'http://proceedings.mlr.press/v84/'
-    },
-    'ACL': {
-        2014: 'http://www.aclweb.org/anthology/P/P14/',
-        2015: 'http://www.aclweb.org/anthology/P/P15/',
-        2016: 'http://www.aclweb.org/anthology/P/P16/',
-        2017: 'http://www.aclweb.org/anthology/P/P17/'
-    },
-    'CVPR': {
-        2014: 'http://openaccess.thecvf.com/CVPR2014.py',
-        2015: 'http://openaccess.thecvf.com/CVPR2015.py',
-        2016: 'http://openaccess.thecvf.com/CVPR2016.py',
-        2017: 'http://openaccess.thecvf.com/CVPR2017.py',
-        2018: 'http://openaccess.thecvf.com/CVPR2018.py'
-    },
-    'IJCAI': {
-        2015: 'https://www.ijcai.org/proceedings/2015/',
-        2016: 'https://www.ijcai.org/proceedings/2016/',
-        2017: 'https://www.ijcai.org/proceedings/2017/',
-        2018: 'https://www.ijcai.org/proceedings/2018/'
-    },
-    'JMLR': {
-        2014: 'http://www.jmlr.org/papers/v15/',
-        2015: 'http://www.jmlr.org/papers/v16/',
-        2016: 'http://www.jmlr.org/papers/v17/',
-        2017: 'http://www.jmlr.org/papers/v18/' # and 2018
-    },
-}
-
-conferences_add_pdf = {
-    # grab the URLs and add .pdf
-    'NIPS': {
-        2014: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-27-2014',
-        2015: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-28-2015',
-        2016: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-29-2016',
-        2017: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-30-2017'
-    },
-}
-
-conferences_hard = {
-    # These will take more work
-    'ICLR': {
-        2015: 'https://iclr.cc/archive/www/doku.php%3Fid=iclr2015:accepted-main.html', # point to arXiv
-        2016: 'https://iclr.cc/archive/www/doku.php%3Fid=iclr2016:accepted-main.html', # point to arXiv
-        #2017: 'https://openreview.net/group?id=ICLR.cc/2017/conference',
-        #2018: 'https://openreview.net/group?id=ICLR.cc/2018/Conference',
-        2017: 'https://openreview.net/notes?invitation=ICLR.cc%2F2017%2Fconference%2F-%2Fpaper.*%2Facceptance', # JSON data
-        2018: 'https://openreview.net/notes?invitation=ICLR.cc%2F2018%2Fconference%2F-%2Fpaper.*%2Facceptance', # JSON data
-    },
-    'AAAI': {
-        2014: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI14/schedConf/presentations',
-        2015: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI15/schedConf/presentations',
-        2016: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI16/schedConf/presentations',
-        2017: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI17/schedConf/presentations',
-        2018: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI18/schedConf/presentations'
-    },
-    # Not worth it -- ACM requires downloading immediately to not get forbidden and doesn't look like there's GAN papers
-    #'KDD': {
-    #    2015: 'http://www.kdd.org/kdd2015/toc.html',
-    #    2016: 'http://www.kdd.org/kdd2016/program/accepted-papers',
-    #    2017: 'http://www.kdd.org/kdd2017/accepted-papers'
-    #},
-    # Springer ones would be difficult
-    #'ECCV': {
-    #    2014: 'http://eccv2014.org/proceedings/',
-    #    2016: 'http://www.eccv2016.org/proceedings/'
-    #},
-    #International Journal of Computer Vision (IJCV) 
-    #Machine Learning (Springer) https://link.springer.com/journal/10994
-}
+import metrics
+import http_pool
+from manifest import Manifest
+from sources import getSources, setBaseURL
 
 def md5sum(s, encoding='utf-8'):
     return md5(s.encode(encoding)).hexdigest()
 
-def get_filename(s):
-    """ https://stackoverflow.com/a/18727481/2698494 """
-    return os.path.basename(urlparse(s).path)
+def get_host(url):
+    """ Host name used to group downloads, e.g. proceedings.mlr.press """
+    return urlparse(url).netloc.lower()
+
+class RateLimiter:
+    """
+    Limit how often requests are started, e.g. rate=2 means at most two
+    requests per second. Shared by all the worker threads of one host.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0/rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+class IncompleteDownload(Exception):
+    """ Connection ended before we received the whole file """
+    pass
 
 def downloadFile(url,
         filename,
         referer=None,
-        useragent='Mozilla/5.0 (X11; Linux x86_64; rv:61.0) Gecko/20100101 Firefox/61.0'):
+        useragent='Mozilla/5.0 (X11; Linux x86_64; rv:61.0) Gecko/20100101 Firefox/61.0',
+        client=None,
+        chunkSize=1024*1024,
+        extraHeaders=None):
+    """
+    Stream url to filename in chunks. The data is written to filename.part and
+    only renamed to filename once complete, so an interrupted download never
+    looks finished. If a .part file exists from a previous attempt, we resume
+    where it left off with a Range request.
+
+    Returns a dict of the HTTP status, size, sha256, etag, and last_modified of
+    the downloaded file or None if it already existed. If extraHeaders makes it
+    a conditional request and the server responds 304 Not Modified, nothing is
+    written and only the status is returned.
+
+    Messages go through tqdm.write so that worker threads downloading at the
+    same time don't interleave them with each other or with the progress bar.
+    """
     if not os.path.exists(filename):
-        print("Downloading", url, "to", filename)
+        tqdm.write("Downloading %s to %s" % (url, filename))
 
         headers = { 'User-Agent': useragent }
 
         if referer is not None:
             headers["Referer"] = referer
 
-        req = urllib.request.Request(url, data=None, headers=headers)
+        if extraHeaders is not None:
+            headers.update(extraHeaders)
+
+        # Resume partial download
+        partial = filename + '.part'
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
 
-        connection = urllib.request.urlopen(req)
-        data = connection.read()
+        if offset > 0:
+            headers["Range"] = "bytes=%d-" % offset
 
-        # Save to the cache file so we don't have to load next time
-        with open(filename, 'wb') as f:
-            f.write(data)
+        # Reuse keep-alive connections to the host
+        if client is None:
+            client = http_pool.getClient()
+
+        try:
+            connection = client.open(url, headers)
+        except urllib.error.HTTPError as e:
+            # Our partial file is bigger than the file on the server, so it's
+            # not the same file. Start over.
+            if e.code == 416 and offset > 0:
+                metrics.inc('download_retries_total', host=get_host(url))
+                os.remove(partial)
+                return downloadFile(url, filename, referer, useragent, client,
+                    chunkSize, extraHeaders)
+            raise
+
+        with connection:
+            if connection.status == 304:
+                return { 'status': 304 }
+
+            # Server ignored the Range header, so we get the whole file
+            if connection.status != 206:
+                offset = 0
+
+            length = connection.getheader('Content-Length')
+            expected = offset + int(length) if length is not None else None
+
+            # Include what we already have in the hash
+            h = sha256()
+            if offset > 0:
+                with open(partial, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunkSize), b''):
+                        h.update(chunk)
+
+            with open(partial, 'r+b' if offset > 0 else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+
+                while True:
+                    chunk = connection.read(chunkSize)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    h.update(chunk)
+
+                size = f.tell()
+
+        if expected is not None and size != expected:
+            raise IncompleteDownload("Got %d of %d bytes for %s" % (size, expected, url))
+
+        # Only now does it appear downloaded
+        os.replace(partial, filename)
+
+        return {
+            'status': connection.status,
+            'size': size,
+            'sha256': h.hexdigest(),
+            'etag': connection.getheader('ETag'),
+            'last_modified': connection.getheader('Last-Modified'),
+        }
     else:
-        print("Skipping", url, ". Exists: ", filename)
+        tqdm.write("Skipping %s . Exists: %s" % (url, filename))
+
+def loadCacheInfo(cache):
+    """
+    Load the metadata saved with a cached page. For pages cached before we
+    saved metadata, use the modification time of the file as the fetch time.
+    """
+    meta = os.path.splitext(cache)[0] + '.json'
+
+    if os.path.exists(meta):
+        with open(meta, 'r') as f:
+            return json.load(f)
+
+    return { 'fetched': os.path.getmtime(cache) }
+
+def saveCacheInfo(cache, info):
+    meta = os.path.splitext(cache)[0] + '.json'
+
+    with open(meta + '.tmp', 'w') as f:
+        json.dump(info, f)
 
-def getLinks(url, cachedir='cache', search='//a/@href', referer=None, raw=False):
+    os.replace(meta + '.tmp', meta)
+
+def fetchPage(url, cache, referer=None, ttl=None):
+    """
+    Make sure url is in the cache file. If the cached copy is older than ttl
+    seconds (never, if ttl is None), revalidate it with a conditional GET so
+    that an unchanged page only costs a 304 response. If revalidating fails,
+    the cached copy is used.
+
+    Returns whether the cache file changed.
+    """
+    if not os.path.exists(cache):
+        info = downloadFile(url, cache, referer)
+        saveCacheInfo(cache, {
+            'url': url,
+            'etag': info.get('etag') if info else None,
+            'last_modified': info.get('last_modified') if info else None,
+            'fetched': time.time(),
+        })
+        return True
+
+    cacheInfo = loadCacheInfo(cache)
+
+    if ttl is None or time.time() - cacheInfo['fetched'] < ttl:
+        return False
+
+    conditional = {}
+    if cacheInfo.get('etag'):
+        conditional['If-None-Match'] = cacheInfo['etag']
+    if cacheInfo.get('last_modified'):
+        conditional['If-Modified-Since'] = cacheInfo['last_modified']
+
+    # Download to a separate file so the old copy stays if it fails
+    new = cache + '.new'
+    for leftover in [new, new + '.part']:
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    # If the site is down, keep using the cached copy as if it hadn't changed,
+    # and revalidate it again next time
+    try:
+        info = downloadFile(url, new, referer, extraHeaders=conditional)
+    except (IncompleteDownload, http.client.HTTPException, OSError) as e:
+        print("Using cached", url, "- failed to revalidate:", e)
+        metrics.inc('revalidation_failures_total', host=get_host(url))
+        return False
+
+    changed = info['status'] != 304
+
+    if changed:
+        os.replace(new, cache)
+        cacheInfo['etag'] = info.get('etag')
+        cacheInfo['last_modified'] = info.get('last_modified')
+
+    cacheInfo['url'] = url
+    cacheInfo['fetched'] = time.time()
+    saveCacheInfo(cache, cacheInfo)
+
+    return changed
+
+def getLinks(url, cachedir='cache', search='//a/@href', referer=None, raw=False,
+        ttl=None):
     """
     Get all the links on a page
     Also return raw content if desired
 
-    Note: caches webpage
+    Note: caches webpage, revalidating it if older than ttl seconds, and the
+    links found with each search so we don't parse unchanged pages again
     """
     # Create cache directory
     if not os.path.exists(cachedir):
@@ -142,162 +248,283 @@ def getLinks(url, cachedir='cache', search='//a/@href', referer=None, raw=False)
 
     # Cache filename
     cache = os.path.join(cachedir, md5sum(url) + '.txt')
+    linkCache = os.path.join(cachedir, md5sum(url) + '.links.json')
 
-    # Download from web it cache doesn't exist
-    if not os.path.exists(cache):
-        downloadFile(url, cache, referer)
+    # Download from web if cache doesn't exist or is out of date
+    fetchPage(url, cache, referer, ttl)
 
     assert os.path.exists(cache), "Tried to download file and failed."
 
+    # The links are valid as long as the cached page hasn't changed
+    stat = os.stat(cache)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    cachedLinks = {}
+
+    if os.path.exists(linkCache):
+        with open(linkCache, 'r') as f:
+            cachedLinks = json.load(f)
+
+        if cachedLinks.get('signature') != signature:
+            cachedLinks = {}
+
+    links = cachedLinks.get('links', {}).get(search)
+
     # Now load from the cache file
-    with open(cache, 'rb') as f: 
-        data = f.read()
+    data = None
+    if links is None or raw:
+        with open(cache, 'rb') as f: 
+            data = f.read()
 
     # Get URLs
-    dom = lxml.html.fromstring(data)
-    links = []
+    if links is None:
+        dom = lxml.html.fromstring(data)
+        links = []
+
+        for link in dom.xpath(search):
+            links.append(str(link))
 
-    for link in dom.xpath(search):
-        links.append(link)
+        cachedLinks.setdefault('links', {})[search] = links
+        cachedLinks['signature'] = signature
+        tmp = linkCache + '.' + str(threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(cachedLinks, f)
+        os.replace(tmp, linkCache)
 
     if raw:
         return links, data
     else:
         return links
 
+def plan(sources, downloaddir, threads=8, ttl=None):
+    """
+    List the (url, filename) of all the papers from the sources. All the index
+    pages are fetched at once, and then all the pages they lead to (e.g. the
+    rest of the OpenReview results or arXiv API queries) at once, and so on.
+    """
+    toDownload = []
+
+    def fetch(source, url):
+        return getLinks(url, search=source.search, raw=source.raw, ttl=ttl)
+
+    with ThreadPoolExecutor(threads) as pool:
+        pages = [(source, year, source.indexURL(year)) for source in sources
+            for year in source.urls]
+
+        while pages:
+            # Each once, e.g. the same arXiv papers linked from two years
+            unique = list(dict.fromkeys((source, url) for source, year, url in pages))
+            results = dict(zip(unique, pool.map(lambda p: fetch(*p), unique)))
+            followed = []
+
+            for source, year, url in pages:
+                result = results[(source, url)]
+                links, data = result if source.raw else (result, None)
+                papers, more = source.expand(year, url, links, data)
+                followed += [(source, year, link) for link in more]
+
+                for abspath, fname in papers:
+                    toDownload.append((abspath, os.path.join(downloaddir, fname)))
+
+            pages = followed
+
+    return toDownload
+
+def downloadOne(link, fname, manifest):
+    """
+    Download one file, recording in the manifest whether it succeeded so that
+    failures are retried later. Returns whether it succeeded.
+    """
+    host = get_host(link)
+    start = time.monotonic()
+
+    try:
+        info = downloadFile(link, fname)
+        manifest.markDone(link, info)
+
+        if info is not None and 'size' in info:
+            metrics.observe('download_seconds', time.monotonic() - start, host=host)
+            metrics.inc('download_bytes_total', info['size'], host=host)
+        metrics.inc('downloads_total', host=host)
+
+        # Only keep one copy if we already have this paper under another name
+        if info is not None:
+            canonical = manifest.duplicateOf(fname, info['sha256'], info['size'])
+
+            if canonical is not None:
+                tqdm.write("Duplicate of %s - %s" % (canonical, fname))
+                os.remove(fname)
+
+        return True
+    except urllib.error.HTTPError as e:
+        tqdm.write("Error downloading %s" % fname)
+        metrics.inc('download_failures_total', host=host, status=e.code)
+        manifest.markFailed(link, e.code)
+        time.sleep(0.5)
+        return False
+    except (IncompleteDownload, http.client.HTTPException, OSError) as e:
+        # Connection problems -- the .part file will be resumed next time
+        tqdm.write("Incomplete download %s - %s" % (fname, e))
+        metrics.inc('download_failures_total', host=host, status=type(e).__name__)
+        manifest.markFailed(link)
+        time.sleep(0.5)
+        return False
+
+def downloadAll(toDownload, manifest, threadsPerHost=2, rate=1.0, hostRates=None):
+    """
+    Download concurrently with a separate queue and set of worker threads for
+    each host. Each host is limited to threadsPerHost simultaneous connections
+    and at most rate requests per second (or hostRates[host] if specified), so
+    we can download from all the sites at once without hammering any of them.
+    """
+    if hostRates is None:
+        hostRates = {}
+
+    queues = {}
+    for link, fname in toDownload:
+        queues.setdefault(get_host(link), queue.Queue()).put((link, fname))
+
+    progress = tqdm(total=len(toDownload))
+    progressLock = threading.Lock()
+
+    def worker(q, limiter):
+        while True:
+            try:
+                link, fname = q.get_nowait()
+            except queue.Empty:
+                return
+
+            limiter.wait()
+
+            # Keep going with the rest of the host's files whatever happens
+            try:
+                downloadOne(link, fname, manifest)
+            except Exception as e:
+                tqdm.write("Failed downloading %s - %r" % (fname, e))
+                metrics.inc('download_failures_total', host=get_host(link),
+                    status=type(e).__name__)
+
+                try:
+                    manifest.markFailed(link)
+                except Exception as e:
+                    tqdm.write("Failed recording failure of %s - %r" % (link, e))
+
+            with progressLock:
+                progress.update(1)
+
+    threads = []
+    for host, q in queues.items():
+        limiter = RateLimiter(hostRates.get(host, rate))
+
+        for i in range(min(threadsPerHost, q.qsize())):
+            t = threading.Thread(target=worker, args=(q, limiter), daemon=True)
+            t.start()
+            threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    progress.close()
+
+def parseHostRate(s):
+    """ Parse --host-rate arguments like openreview.net=0.5 """
+    host, sep, rate = s.partition('=')
+
+    try:
+        rate = float(rate)
+    except ValueError:
+        rate = None
+
+    if not host or not sep or rate is None:
+        raise argparse.ArgumentTypeError("should be like openreview.net=0.5, not " + s)
+
+    return host.lower(), rate
+
 if __name__ == '__main__':
-    prepend="" # e.g. ICML_2015_
+    parser = argparse.ArgumentParser(description="Download ML and AI papers from 2014-2018")
+    parser.add_argument('--concurrent', action='store_true',
+        help="download from all hosts at once rather than one file at a time")
+    parser.add_argument('--threads-per-host', type=int, default=2,
+        help="with --concurrent, simultaneous downloads per host (default 2)")
+    parser.add_argument('--rate', type=float, default=1.0,
+        help="with --concurrent, max requests per second per host (default 1)")
+    parser.add_argument('--host-rate', action='append', default=[], metavar='HOST=RATE',
+        type=parseHostRate,
+        help="override --rate for one host, e.g. openreview.net=0.5")
+    parser.add_argument('--recheck', action='store_true',
+        help="download again any files that were deleted from pdfs/")
+    parser.add_argument('--cache-ttl', type=float, default=None, metavar='HOURS',
+        help="revalidate cached index pages older than this (default: never)")
+    parser.add_argument('--venue', action='append', default=None,
+        help="only download this venue, e.g. ICML (may be repeated)")
+    parser.add_argument('--crawl-threads', type=int, default=8,
+        help="index pages to fetch at once (default 8)")
+    parser.add_argument('--pool-size', type=int, default=4,
+        help="max keep-alive connections per host (default 4)")
+    parser.add_argument('--http2', action='store_true',
+        help="use HTTP/2 where supported (requires httpx[http2])")
+    parser.add_argument('--base-url', action='append', default=[], metavar='URL=URL',
+        help="fetch URLs starting with the first from the second instead, e.g. "
+            "https://openreview.net=http://localhost:8000 (may be repeated)")
+    metrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.configure(args.metrics, args.profile)
+
+    for override in args.base_url:
+        original, sep, replacement = override.partition('=')
+        if not sep or not replacement:
+            parser.error("--base-url should be like https://openreview.net=http://localhost:8000")
+        setBaseURL(original, replacement)
+
+    http_pool.configure(poolSize=max(args.pool_size, args.threads_per_host),
+        http2=args.http2)
+
     downloaddir='pdfs'
-    errors="error.txt"
+    errors="error.txt" # from before the manifest, only read
+    manifestFile="manifest.sqlite"
+
+    ttl = args.cache_ttl*3600 if args.cache_ttl is not None else None
 
     # Create download directory
     if not os.path.exists(downloaddir):
         os.makedirs(downloaddir)
 
     # List of files to download
-    toDownload = []
+    with metrics.stage('plan') as stage:
+        toDownload = plan(getSources(args.venue), downloaddir, args.crawl_threads, ttl)
+        stage.items = len(toDownload)
 
-    # Easy-to-download PDFs
-    for conf, years in conferences_easy.items():
-        for year, url in years.items():
-            prepend = conf+"_"+str(year)+"_"
-            links = getLinks(url)
-
-            # Only download PDFs that are not supplementary material
-            for link in links:
-                # -supp -- PMLR supplementary material
-                # supplemental/ -- CVPR supplemental material
-                # AbsBook -- CVPR extracted abstracts from PDFs
-                # poster/ -- CVPR posters
-                # erratum. -- IJCAI erratum for papers
-                # frontmatter -- IJCAI front matter
-                # appendix -- JMLR appendices
-                # attachments/ -- ACL has some datasets, notes, presentations, etc. files
-                if ".pdf" in link \
-                        and "-supp" not in link \
-                        and "supplemental/" not in link \
-                        and "AbsBook" not in link \
-                        and "poster/" not in link \
-                        and "erratum." not in link \
-                        and "frontmatter" not in link \
-                        and "appendix" not in link \
-                        and "attachments/" not in link:
-                    abspath = urljoin(url.strip(), link.strip()) # some links are relative, some have newlines at the end
-                    fname = prepend + get_filename(abspath)
-                    toDownload.append((abspath, os.path.join(downloaddir, fname)))
+    # Throw out all that were already downloaded or recently failed. Files
+    # already in pdfs/ and failures in the old error.txt are imported the first
+    # time a URL is seen.
+    manifest = Manifest(manifestFile)
+    manifest.add(toDownload, downloaddir, errors)
 
-    # Some require adding .pdf to the filename
-    for conf, years in conferences_add_pdf.items():
-        for year, url in years.items():
-            prepend = conf+"_"+str(year)+"_"
-            links = getLinks(url)
-
-            # Only download PDFs that are not supplementary material
-            for link in links:
-                if "/paper" in link:
-                    abspath = urljoin(url.strip(), link.strip()) + '.pdf' # NIPS links are relative and have .pdf at end
-                    fname = prepend + get_filename(abspath)
-                    toDownload.append((abspath, os.path.join(downloaddir, fname)))
-    
-    # The ones that require some effort
-    acmMatch = re.compile(r"window\.location\.replace\('(.*)'\);")
-
-    for conf, years in conferences_hard.items():
-        for year, url in years.items():
-            prepend = conf+"_"+str(year)+"_"
-
-            # OpenReview papers (e.g. ICLR)
-            if "openreview.net/notes" in url:
-                _, rawData = getLinks(url, raw=True)
-                j = json.loads(rawData.decode('utf-8'))
-
-                for entry in j["notes"]:
-                    if "Accept" in entry["content"]["decision"]:
-                        # Looks like replyto and forum link to the ID of the actual PDF
-                        toDownload.append(("https://openreview.net/pdf?id="+entry["replyto"],
-                            os.path.join(downloaddir, prepend+entry["replyto"]+".pdf")))
-
-            elif "AAAI" in conf:
-                links = getLinks(url, search="//a[contains(@class, 'file')]/@href")
-
-                for link in links:
-                    # For AAAI papers, make a substitution in the link
-                    if "paper/view" in link:
-                        abspath = urljoin(url.strip(), link.strip().replace("paper/view","paper/download")) # get download URL
-                        fname = prepend + get_filename(abspath) + ".pdf"
-                        toDownload.append((abspath, os.path.join(downloaddir, fname)))
-            else:
-                links = getLinks(url)
-
-                for link in links:
-                    # If it links to arXiv, then download the PDF on arXiv
-                    # Note: this doesn't download it if the latest arXiv version doesn't provide a PDF
-                    if "arxiv.org" in link:
-                        arXivLinks = getLinks(link)
-
-                        for arXivLink in arXivLinks:
-                            if "pdf/" in arXivLink:
-                                abspath = urljoin(link.strip(), arXivLink.strip()) # make PDF link relative to arXiv URL
-                                fname = prepend + get_filename(abspath) + ".pdf"
-                                toDownload.append((abspath, os.path.join(downloaddir, fname)))
-                    # For KDD papers that link to ACM
-                    """
-                    elif "KDD" in conf and "dl.acm.org" in link:
-                        pass
-                        _, acmData = getLinks(link, raw=True, referer=url) # Gives different page without referer
-                        match = acmMatch.search(acmData.decode('utf-8')) # PDF link is in Javascript code
-                        if match is not None:
-                            pdf = match.group(1)
-                            abspath = urljoin(url.strip(), pdf.strip())
-                            fname = prepend + get_filename(abspath)
-                            downloadFile(abspath, os.path.join(downloaddir, fname))
-                    """
-
-
-    # Get the list of ones that errored
-    error_files = []
-    if os.path.exists(errors):
-        with open(errors, 'r') as f:
-            for line in f:
-                error_files.append(line.strip())
-
-    # Throw out all that were already downloaded
-    notDownloaded = []
+    if args.recheck:
+        print("Missing files to redownload:", manifest.recheck(downloaddir))
 
-    for link, fname in toDownload:
-        if not os.path.exists(fname) and link not in error_files:
-            notDownloaded.append((link, fname))
+    # Only those planned, so e.g. --venue ICML doesn't retry other venues
+    notDownloaded = manifest.pending(url for url, fname in toDownload)
 
     # Now shuffle and then download. This supposedly will make it so we don't
     # download everything from the same site at the same time. Hopefully make
     # me not get blocked.
     random.shuffle(notDownloaded)
 
-    for link, fname in tqdm(notDownloaded):
-        try:
-            downloadFile(link, fname)
-        except urllib.error.HTTPError:
-            print("Error downloading", fname)
-            with open(errors, 'a') as f:
-                f.write(link+'\n')
-            time.sleep(0.5)
+    with metrics.stage('download') as stage:
+        if args.concurrent:
+            hostRates = dict(args.host_rate)
+            downloadAll(notDownloaded, manifest, args.threads_per_host, args.rate, hostRates)
+        else:
+            for link, fname in tqdm(notDownloaded):
+                downloadOne(link, fname, manifest)
+
+        stage.items = len(notDownloaded)
+
+    counts = manifest.counts()
+    for state, count in counts.items():
+        metrics.gauge('manifest_files', count, state=state)
+
+    print("Manifest:", counts)
+    manifest.close()
+    metrics.save()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Copy the papers in a list to a directory or a single tar or zip file
+
+Reads any list whose first column (tab separated) is the filename, e.g.
+list/overlap.txt, list/gan.txt, or the output of term_index.py, or - for
+stdin. Rather than copying the bytes, each file is hardlinked into the
+directory, or reflinked (a copy-on-write clone on e.g. Btrfs or XFS) if it
+can't be, so the subset takes no extra space and remains when pdfs/ is
+deleted. On another filesystem, files are copied several at a time. A bundle
+is written in one pass, so it can be streamed, e.g. to ssh. For example:
+
+    ./export_subset.py list/overlap.txt pdfs_just_overlap
+    ./export_subset.py list/gan.txt --bundle gan.zip
+    ./term_index.py "GAN* AND multi-task" | ./export_subset.py - --bundle - | ssh host tar x
+"""
+import os
+import sys
+import errno
+import shutil
+import tarfile
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm # progress bar
+
+# From linux/fs.h, to clone a file
+FICLONE = 0x40049409
+
+methods = ('auto', 'hardlink', 'reflink', 'copy')
+
+def readList(filename):
+    """ Filenames in the first column of the list, without duplicates """
+    f = sys.stdin if filename == '-' else open(filename)
+    files = []
+    seen = set()
+
+    try:
+        for line in f:
+            fname = line.rstrip('\n').split('\t', 1)[0]
+
+            # Skip blank lines and the header of e.g. grep/matches.tsv
+            if fname and fname != 'Filename' and fname not in seen:
+                seen.add(fname)
+                files.append(fname)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    return files
+
+def reflink(src, dest):
+    """ Clone src to dest, raising OSError if the filesystem can't """
+    import fcntl
+
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dest)
+            raise
+
+    shutil.copystat(src, dest)
+
+def exportFile(src, dest, method='auto'):
+    """
+    Hardlink, reflink, or copy src to dest, trying each in turn for auto.
+    Returns which was used, or None if dest is already the same file.
+    """
+    if os.path.exists(dest):
+        s, d = os.stat(src), os.stat(dest)
+
+        if os.path.samestat(s, d) or (s.st_size == d.st_size
+                and int(s.st_mtime) == int(d.st_mtime)):
+            return None
+
+        os.remove(dest)
+
+    if method in ('auto', 'hardlink'):
+        try:
+            os.link(src, dest)
+            return 'hardlink'
+        except OSError as e:
+            # Only fall back if it's another filesystem or can't have links
+            if method == 'hardlink' or e.errno not in (errno.EXDEV, errno.EPERM,
+                    errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+
+    if method in ('auto', 'reflink'):
+        try:
+            reflink(src, dest)
+            return 'reflink'
+        except (OSError, ImportError):
+            if method == 'reflink':
+                raise
+
+    shutil.copy2(src, dest)
+    return 'copy'
+
+def exportDirectory(files, outdir, method='auto', threads=8):
+    """ Export the files to outdir. Returns how many used each method. """
+    os.makedirs(outdir, exist_ok=True)
+    counts = dict((m, 0) for m in methods[1:] + ('existing',))
+
+    def export(src):
+        return exportFile(src, os.path.join(outdir, os.path.basename(src)), method)
+
+    # Threads since it's waiting on the disk, not the CPU
+    with ThreadPoolExecutor(threads) as pool:
+        for used in tqdm(pool.map(export, files), total=len(files)):
+            counts[used or 'existing'] += 1
+
+    return counts
+
+def bundleFormat(filename):
+    """ (tar or zip, compression) from the bundle's extension, tar for stdout """
+    for ext, compression in (('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'),
+            ('.tar.xz', 'xz'), ('.tar', '')):
+        if filename.endswith(ext):
+            return 'tar', compression
+
+    if filename.endswith('.zip'):
+        return 'zip', None
+
+    if filename == '-':
+        return 'tar', ''
+
+    raise ValueError("bundle should end in .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz, or .zip")
+
+def exportBundle(files, filename, prefix=''):
+    """
+    Write the files to one tar or zip file (or - for stdout) in a single pass,
+    so nothing is seeked and it can be piped. PDFs are already compressed, so
+    zip files are stored rather than compressed again.
+    """
+    kind, compression = bundleFormat(filename)
+    out = sys.stdout.buffer if filename == '-' else open(filename, 'wb')
+
+    try:
+        if kind == 'tar':
+            with tarfile.open(fileobj=out, mode='w|'+compression) as tar:
+                for fname in tqdm(files):
+                    tar.add(fname, os.path.join(prefix, os.path.basename(fname)))
+        else:
+            with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED, allowZip64=True) as z:
+                for fname in tqdm(files):
+                    z.write(fname, os.path.join(prefix, os.path.basename(fname)))
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    return len(files)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copy the papers in a list to a directory or a tar or zip file")
+    parser.add_argument('list',
+        help="file with a filename in the first column of each line, e.g. list/overlap.txt, or - for stdin")
+    parser.add_argument('outdir', nargs='?', default=None,
+        help="directory to put them in")
+    parser.add_argument('--bundle', default=None, metavar='FILE',
+        help="write them to a .tar, .tar.gz, .tar.xz, or .zip file instead, or - for a tar to stdout")
+    parser.add_argument('--prefix', default='',
+        help="directory to put them in inside the bundle")
+    parser.add_argument('--method', default='auto', choices=methods,
+        help="how to export to a directory (default: hardlink, else reflink, else copy)")
+    parser.add_argument('--threads', type=int, default=8,
+        help="files to copy at once (default 8)")
+    args = parser.parse_args()
+
+    if (args.outdir is None) == (args.bundle is None):
+        parser.error("give either an output directory or --bundle")
+
+    if args.bundle is not None:
+        try:
+            bundleFormat(args.bundle)
+        except ValueError as e:
+            parser.error(str(e))
+
+    files = readList(args.list)
+    missing = [fname for fname in files if not os.path.isfile(fname)]
+    files = [fname for fname in files if os.path.isfile(fname)]
+
+    # Status to stderr since the bundle may be going to stdout
+    for fname in missing:
+        print("Missing:", fname, file=sys.stderr)
+
+    if args.bundle is not None:
+        exportBundle(files, args.bundle, args.prefix)
+        print("Bundled:", len(files), file=sys.stderr)
+    else:
+        try:
+            counts = exportDirectory(files, args.outdir, args.method, args.threads)
+        except OSError as e:
+            # Only when a method was chosen, otherwise it'd have copied them
+            sys.exit("Couldn't %s: %s" % (args.method, e))
+
+        print(", ".join("%s: %d" % (m.capitalize(), c) for m, c in counts.items()
+            if c), file=sys.stderr)
+
+    if missing:
+        print("Missing:", len(missing), file=sys.stderr)
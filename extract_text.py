@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Extract the text of the first few pages of each PDF once
+
+Rather than having pdfgrep parse every PDF again for each search, save the text
+of the first pages of each PDF compressed in text.sqlite, keyed by the hash of
+the PDF. Files that haven't changed (same size and modification time, or same
+hash) are skipped, and the rest are extracted in parallel on all cores.
+
+Uses PyMuPDF if installed, otherwise pdfminer.six, otherwise pdftotext. If
+none of them are installed, nothing is extracted.
+
+Where the abstract, body, and references start is also saved, so searches can
+be limited to them (see match_terms.py) without extracting the text again.
+"""
+import os
+import re
+import zlib
+import json
+import shutil
+import sqlite3
+import argparse
+import subprocess
+from multiprocessing import Pool
+from tqdm import tqdm # progress bar
+
+import metrics
+from manifest import sha256sum
+
+# Increment when changing how text is extracted so it's extracted again
+extractVersion = 1
+
+# Increment when changing how sections are found so they're found again
+sectionVersion = 1
+
+sections = ('front', 'abstract', 'body', 'references')
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS text (
+    sha256 TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    pages INTEGER NOT NULL,
+    error TEXT,
+    data BLOB NOT NULL, -- zlib compressed, pages separated by form feeds
+    sections TEXT -- JSON from findSections()
+);
+"""
+
+abstractRegex = re.compile(r'^[ \t]*abstract\b', re.IGNORECASE | re.MULTILINE)
+introRegex = re.compile(r'^[ \t]*(?:(?:1|I)\.?[ \t]+)?introduction\b',
+    re.IGNORECASE | re.MULTILINE)
+referencesRegex = re.compile(r'^[ \t]*(?:references|bibliography)[ \t]*$',
+    re.IGNORECASE | re.MULTILINE)
+
+class NoBackend(Exception):
+    """ None of the libraries or tools to extract text with are installed """
+    pass
+
+def getBackend():
+    """ Which library to extract text with, or None if none are installed """
+    try:
+        import fitz
+        return 'pymupdf'
+    except ImportError:
+        pass
+
+    try:
+        import pdfminer.high_level
+        return 'pdfminer'
+    except ImportError:
+        pass
+
+    if shutil.which('pdftotext') is not None:
+        return 'pdftotext'
+
+    return None
+
+def extractPages(filename, pages=3, backend=None):
+    """ List of the text of the first few pages of a PDF """
+    if backend is None:
+        backend = getBackend()
+
+    if backend == 'pymupdf':
+        import fitz
+
+        with fitz.open(filename) as doc:
+            return [doc[i].get_text() for i in range(min(pages, len(doc)))]
+    elif backend == 'pdfminer':
+        import pdfminer.high_level
+
+        text = pdfminer.high_level.extract_text(filename,
+            page_numbers=list(range(pages)))
+    else:
+        text = subprocess.run(['pdftotext', '-q', '-enc', 'UTF-8',
+            '-f', '1', '-l', str(pages), filename, '-'],
+            stdout=subprocess.PIPE, check=True).stdout.decode('utf-8', 'replace')
+
+    # Each page ends in a form feed
+    text = text.split('\f')
+    if text and not text[-1].strip():
+        text = text[:-1]
+
+    return text[:pages]
+
+def findHeading(regex, pages, after=(1, 0), last=False):
+    """ (page starting at 1, offset) of the first (or last) match after a position """
+    found = None
+
+    for page, text in enumerate(pages, 1):
+        if page < after[0]:
+            continue
+
+        for m in regex.finditer(text, after[1] if page == after[0] else 0):
+            found = (page, m.start())
+
+            if not last:
+                return found
+
+    return found
+
+def findSections(pages):
+    """
+    Where each section starts, as a list of (section, page starting at 1,
+    offset in the page). Text before the abstract is the front matter (title,
+    authors), the abstract ends at the introduction (or the end of its page),
+    and the references start at the last References heading. If there's no
+    abstract or introduction, it's all body until the references.
+    """
+    abstract = findHeading(abstractRegex, pages)
+    intro = findHeading(introRegex, pages, abstract or (1, 0))
+    found = []
+
+    if abstract is not None:
+        found += [('front', 1, 0), ('abstract',) + abstract]
+
+        if intro is not None:
+            found.append(('body',) + intro)
+        elif abstract[0] < len(pages):
+            found.append(('body', abstract[0]+1, 0))
+    elif intro is not None:
+        found += [('front', 1, 0), ('body',) + intro]
+    else:
+        found.append(('body', 1, 0))
+
+    references = findHeading(referencesRegex, pages, found[-1][1:], last=True)
+    if references is not None:
+        found.append(('references',) + references)
+
+    return found
+
+def sectionOf(starts, page, offset):
+    """ Which section the text at this page and offset is in """
+    section = starts[0][0]
+
+    for name, p, o in starts:
+        if (p, o) > (page, offset):
+            break
+        section = name
+
+    return section
+
+def encodePages(pages):
+    return zlib.compress('\f'.join(pages).encode('utf-8'))
+
+def decodePages(data):
+    text = zlib.decompress(data).decode('utf-8')
+    return text.split('\f') if text else []
+
+class TextStore:
+    """ Extracted text of each PDF """
+    def __init__(self, filename='text.sqlite'):
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(schema)
+
+        # Created before sections were saved
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(text)")]
+        if 'sections' not in columns:
+            with self.db:
+                self.db.execute("ALTER TABLE text ADD COLUMN sections TEXT")
+
+    def hashes(self):
+        """ Dictionary from filename to (size, mtime, sha256) """
+        return dict((fname, (size, mtime, h)) for fname, size, mtime, h in
+            self.db.execute("SELECT filename, size, mtime, sha256 FROM files"))
+
+    def extracted(self, version):
+        """
+        Set of hashes already extracted with this version. Those that failed
+        since the tool was missing, saved before such errors weren't saved,
+        are extracted again.
+        """
+        return set(h for h, in self.db.execute("""SELECT sha256 FROM text
+            WHERE version = ? AND (error IS NULL
+                OR error NOT LIKE 'FileNotFoundError%')""", (version,)))
+
+    def setFiles(self, files, replace=True):
+        """
+        Replace the file list with (filename, size, mtime, sha256) rows, or
+        only add or update these rows if replace=False
+        """
+        with self.db:
+            if replace:
+                self.db.execute("DELETE FROM files")
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", files)
+
+    def add(self, sha256, version, pages, error=None, sections=None):
+        if sections is None:
+            sections = findSections(pages)
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO text VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, version, len(pages), error, encodePages(pages),
+                json.dumps([sectionVersion, sections])))
+
+    def get(self, filename):
+        """ List of the text of each extracted page, or None if not extracted """
+        row = self.db.execute("""SELECT data FROM files JOIN text USING (sha256)
+            WHERE filename = ?""", (filename,)).fetchone()
+        return decodePages(row[0]) if row is not None else None
+
+    def getHash(self, sha256):
+        """ List of the text of each extracted page of the PDF with this hash """
+        row = self.db.execute("SELECT data FROM text WHERE sha256 = ?",
+            (sha256,)).fetchone()
+        return decodePages(row[0]) if row is not None else None
+
+    def getSections(self, sha256, pages=None):
+        """
+        Where each section starts (see findSections()) in the PDF with this
+        hash. If they were found with an older version, they're found again
+        from the pages if given (or else loaded) and saved.
+        """
+        row = self.db.execute("SELECT sections FROM text WHERE sha256 = ?",
+            (sha256,)).fetchone()
+
+        if row is None:
+            return None
+
+        if row[0] is not None:
+            version, starts = json.loads(row[0])
+            if version == sectionVersion:
+                return [tuple(s) for s in starts]
+
+        if pages is None:
+            pages = self.getHash(sha256)
+
+        starts = findSections(pages)
+        with self.db:
+            self.db.execute("UPDATE text SET sections = ? WHERE sha256 = ?",
+                (json.dumps([sectionVersion, starts]), sha256))
+
+        return starts
+
+    def files(self):
+        """ Iterate over (filename, sha256, extraction version) without the text """
+        return self.db.execute("""SELECT filename, sha256, version
+            FROM files JOIN text USING (sha256) ORDER BY filename""")
+
+    def items(self):
+        """ Iterate over (filename, sha256, list of page text) """
+        for fname, h, data in self.db.execute("""SELECT filename, sha256, data
+                FROM files JOIN text USING (sha256) ORDER BY filename"""):
+            yield fname, h, decodePages(data)
+
+    def close(self):
+        self.db.close()
+
+def hashFile(args):
+    fname, size, mtime = args
+    return fname, size, mtime, sha256sum(fname)
+
+def extractFile(args):
+    """ Run in the worker processes """
+    fname, sha256, pages, backend = args
+
+    try:
+        text = extractPages(fname, pages, backend)
+        return sha256, text, None, findSections(text)
+    except OSError as e:
+        # Not the PDF's fault (e.g. the file was deleted), so try again next time
+        return sha256, None, repr(e), None
+    except Exception as e:
+        # Probably not a valid PDF, remember so we don't try again
+        return sha256, [], repr(e), []
+
+def extractAll(pdfdir='pdfs', storeFile='text.sqlite', pages=3, processes=None,
+        filenames=None, progress=True):
+    """
+    Extract the text of all new or changed PDFs in pdfdir, or only of the
+    given filenames (e.g. just downloaded) if specified. Raises NoBackend if
+    there's nothing to extract text with.
+    """
+    backend = getBackend()
+
+    if backend is None:
+        raise NoBackend("Install PyMuPDF, pdfminer.six, or pdftotext (poppler-utils)")
+
+    version = "%d-%s-%d" % (extractVersion, backend, pages)
+    store = TextStore(storeFile)
+    known = store.hashes()
+
+    if filenames is None:
+        entries = [(entry.path, entry.stat()) for entry in os.scandir(pdfdir)
+            if entry.is_file() and entry.name.endswith('.pdf')]
+    else:
+        entries = [(fname, os.stat(fname)) for fname in filenames]
+
+    # Only hash the files that changed since last time
+    files = []
+    toHash = []
+
+    for fname, stat in entries:
+        if fname in known and known[fname][:2] == (stat.st_size, stat.st_mtime_ns):
+            files.append((fname,) + known[fname])
+        else:
+            toHash.append((fname, stat.st_size, stat.st_mtime_ns))
+
+    with Pool(processes) as pool:
+        with metrics.stage('hash') as stage:
+            for result in tqdm(pool.imap_unordered(hashFile, toHash, chunksize=16),
+                    total=len(toHash), desc="Hashing", disable=not progress):
+                files.append(result)
+
+            store.setFiles(files, replace=filenames is None)
+            stage.items = len(toHash)
+
+        # Only extract the ones we haven't extracted before
+        done = store.extracted(version)
+        toExtract = {}
+        for fname, size, mtime, h in files:
+            if h not in done:
+                toExtract[h] = (fname, h, pages, backend)
+
+        with metrics.stage('extract') as stage:
+            errors = 0
+
+            for h, text, error, starts in tqdm(pool.imap_unordered(extractFile,
+                    toExtract.values(), chunksize=4),
+                    total=len(toExtract), desc="Extracting", disable=not progress):
+                if text is not None:
+                    store.add(h, version, text, error, starts)
+                errors += error is not None
+
+            stage.items = len(toExtract)
+            metrics.inc('extract_errors_total', errors)
+
+    store.close()
+
+    return len(files), len(toExtract)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extract text from the first pages of the PDFs")
+    parser.add_argument('--pages', type=int, default=3,
+        help="number of pages to extract from each PDF (default 3)")
+    parser.add_argument('--processes', type=int, default=None,
+        help="PDFs to extract at once (default: number of cores)")
+    metrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.configure(args.metrics, args.profile)
+
+    try:
+        total, extracted = extractAll('pdfs', 'text.sqlite', args.pages, args.processes)
+    except NoBackend as e:
+        parser.exit(1, "Error: %s\n" % e)
+
+    print("PDFs:", total, "Extracted:", extracted)
+    metrics.save()
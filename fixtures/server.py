@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the OpenReview and arXiv APIs and the ICLR index pages
+
+Serves the fixtures in this directory like the real sites do, so the ICLR
+sources can be tried without the network:
+
+    /notes?invitation=...&offset=...&limit=... -- the notes in
+        openreview_notes.json with that invitation, at most --max-limit at a
+        time along with the total count (like OpenReview, which returns at
+        most 1000)
+    /api/query?id_list=... -- the entries in arxiv.xml with those IDs
+    /archive/... -- iclr2015.html or iclr2016.html, the ICLR index pages
+    /pdf?id=... and /pdf/... -- paper.pdf
+
+For example:
+
+    ./fixtures/server.py --port 8000 &
+    ./download_pdfs.py --venue ICLR --base-url https://openreview.net=http://localhost:8000 \
+        --base-url http://export.arxiv.org=http://localhost:8000 \
+        --base-url https://arxiv.org=http://localhost:8000 \
+        --base-url https://iclr.cc=http://localhost:8000
+"""
+import os
+import json
+import argparse
+import functools
+import http.server
+import lxml.etree
+from urllib.parse import urlparse, parse_qs
+
+fixtures = os.path.dirname(os.path.abspath(__file__))
+atom = '{http://www.w3.org/2005/Atom}'
+
+def load(name):
+    with open(os.path.join(fixtures, name), 'rb') as f:
+        return f.read()
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def __init__(self, *args, maxLimit=10, count=True, **kwargs):
+        self.maxLimit = maxLimit
+        self.count = count
+        super().__init__(*args, **kwargs)
+
+    def send(self, body, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def notes(self, query):
+        notes = [note for note in json.loads(load('openreview_notes.json'))['notes']
+            if note['invitation'] == query.get('invitation', [''])[0]]
+        offset = int(query.get('offset', ['0'])[0])
+        limit = min(int(query.get('limit', [str(self.maxLimit)])[0]), self.maxLimit)
+        result = {'notes': notes[offset:offset+limit]}
+
+        if self.count:
+            result['count'] = len(notes)
+
+        return json.dumps(result).encode('utf-8')
+
+    def arxiv(self, query):
+        ids = query.get('id_list', [''])[0].split(',')
+        feed = lxml.etree.fromstring(load('arxiv.xml'))
+        entries = {}
+
+        for entry in feed.findall(atom + 'entry'):
+            versioned = entry.findtext(atom + 'id').rsplit('/abs/', 1)[1]
+            entries[versioned] = entries[versioned.rsplit('v', 1)[0]] = entry
+            feed.remove(entry)
+
+        # In the order asked for, like arXiv
+        for i in ids:
+            if i in entries:
+                feed.append(entries[i])
+
+        return lxml.etree.tostring(feed, xml_declaration=True, encoding='UTF-8')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/notes':
+            self.send(self.notes(query), 'application/json')
+        elif url.path == '/api/query':
+            self.send(self.arxiv(query), 'application/atom+xml')
+        elif url.path.startswith('/archive/'):
+            year = '2016' if 'iclr2016' in url.path else '2015'
+            self.send(load('iclr' + year + '.html'), 'text/html')
+        elif url.path == '/pdf' or url.path.startswith('/pdf/'):
+            self.send(load('paper.pdf'), 'application/pdf')
+        else:
+            self.send_error(404)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the fixtures like OpenReview, arXiv, and ICLR")
+    parser.add_argument('--port', type=int, default=8000,
+        help="port to listen on (default 8000)")
+    parser.add_argument('--max-limit', type=int, default=10,
+        help="most notes to return at once (default 10)")
+    parser.add_argument('--no-count', action='store_true',
+        help="don't say how many notes there are in total")
+    args = parser.parse_args()
+
+    handler = functools.partial(Handler, maxLimit=args.max_limit, count=not args.no_count)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+    print("Serving on http://localhost:%d" % args.port)
+    server.serve_forever()
@@ -1,24 +1,222 @@
 #!/usr/bin/env python3
 """
 From the pdfgrep output data, generate a chart
+
+By default only prints the counts and writes the lists of papers. Use --plot
+to also make the chart, which is the only time matplotlib is imported.
 """
 import os
+import sys
+import csv
+import argparse
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.gridspec import GridSpec
 
-def replace(df, replacements):
+import metrics
+from sources import parseFilename
+
+def pyplot():
+    """
+    Import matplotlib.pyplot, using a non-interactive backend when there's no
+    display (e.g. in cron) unless one was picked with MPLBACKEND
+    """
+    import matplotlib
+
+    if 'MPLBACKEND' not in os.environ and sys.platform.startswith('linux') \
+            and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+        matplotlib.use('Agg')
+
+    import matplotlib.pyplot as plt
+    return plt
+
+def scipySparse():
+    """ scipy.sparse, or None if SciPy isn't installed """
+    try:
+        from scipy import sparse
+        return sparse
+    except ImportError:
+        return None
+
+def internChunk(chunk, files, replacements=None):
+    """
+    Unique (File, Term) rows of a chunk of matches, where filenames are
+    replaced by integer ids from the files dictionary (adding new ones) and
+    terms are lowercased and then replaced if in replacements, e.g.
+    replacements={'s': 'r'} replaces all 's' (or 'S') terms with 'r'.
+
+    Only the unique filenames and terms of each chunk are looked up or
+    lowercased rather than every row.
+    """
+    chunk = chunk.dropna()
+    codes, uniques = pd.factorize(chunk['Filename'])
+    ids = np.array([files.setdefault(f, len(files)) for f in uniques], dtype=np.int32)
+    df = pd.DataFrame({'File': ids[codes]})
+
+    if 'Term' in chunk:
+        replacements = replacements or {}
+        codes, uniques = pd.factorize(chunk['Term'])
+        terms = [t.lower() for t in uniques]
+        terms = np.array([replacements.get(t, t) for t in terms], dtype=object)
+        df['Term'] = terms[codes]
+
+    return df.drop_duplicates()
+
+def concatUnique(parts, columns):
+    if not parts:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(parts, ignore_index=True).drop_duplicates(ignore_index=True)
+
+def readGrep(filename, files, replacements=None, terms=True, chunksize=1000000):
     """
-    If replacements={'s': 'r'} then replace all 's' with 'r' in dataframe df.
+    Read pdfgrep -Z output in chunks, keeping only the unique (File, Term)
+    rows (see internChunk), so memory depends on the number of unique files
+    rather than the number of matches. If terms=False, only read filenames.
+    """
+    reader = pd.read_csv(filename, sep='\x00', names=['Filename','Term'],
+        usecols=['Filename','Term'] if terms else ['Filename'],
+        dtype=str, quoting=csv.QUOTE_NONE, chunksize=chunksize)
+    parts = [internChunk(chunk, files, replacements) for chunk in reader]
+
+    return concatUnique(parts, ['File','Term'] if terms else ['File'])
+
+def readMatches(filename, files, chunksize=1000000):
+    """
+    Read match_terms.py output in chunks like readGrep(), returning a
+    dictionary from each family to its unique (File, Term) rows
+    """
+    reader = pd.read_csv(filename, sep='\t', usecols=['Filename','Family','Term'],
+        dtype=str, quoting=csv.QUOTE_NONE, chunksize=chunksize)
+    parts = {}
+
+    for chunk in reader:
+        for family, rows in chunk.groupby('Family'):
+            parts.setdefault(family, []).append(internChunk(rows, files))
+
+    return dict((family, concatUnique(p, ['File','Term'])) for family, p in parts.items())
+
+def sortedFiles(files):
+    """
+    Sorted filenames and an array to map the ids in the files dictionary to
+    the index in the sorted filenames
+    """
+    names = np.array(list(files.keys()), dtype=object)
+    order = np.argsort(names, kind='stable')
+    remap = np.empty(len(order), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
 
-    Note: case refers to case-sensitivity, which by default is False, i.e.
-    in the above example 'S' would also be replaced with 'r'.
+    return pd.Index(names[order]), remap
+
+def toCategorical(df, names, remap):
+    """
+    Convert the File ids to a Filename column and the Term column, if any, to
+    a categorical column, both with sorted categories
     """
-    for s, r in replacements.items():
-        df = df.str.lower().replace(s, r)
+    out = pd.DataFrame({'Filename': pd.Categorical.from_codes(
+        remap[df['File'].to_numpy(dtype=np.int64)], categories=names)})
 
-    return df
+    if 'Term' in df:
+        out['Term'] = pd.Categorical(df['Term'].to_numpy(),
+            categories=sorted(df['Term'].unique()))
+
+    return out
+
+def incidence(df, papers, terms):
+    """
+    Matrix with a row for each paper and a column for each term, 1 if the paper
+    includes the term. Rows of df for other papers or terms are ignored.
+
+    Sparse if scipy is available.
+    """
+    sparse = scipySparse()
+    rows = pd.Index(np.asarray(papers)).get_indexer(np.asarray(df['Filename']))
+    cols = pd.Index(np.asarray(terms)).get_indexer(np.asarray(df['Term']))
+    keep = (rows >= 0) & (cols >= 0)
+    rows, cols = rows[keep], cols[keep]
+    shape = (len(papers), len(terms))
+
+    if sparse is not None:
+        m = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+            shape=shape).tocsr()
+        m.data[:] = 1 # duplicate rows are summed, but we only want 0 or 1
+        return m
+    else:
+        m = np.zeros(shape, dtype=np.int64)
+        m[rows, cols] = 1
+        return m
+
+def columnSums(m):
+    """ Number of papers including each term """
+    return np.asarray(m.sum(axis=0)).ravel()
+
+def anyTerm(m):
+    """ Whether each paper includes any of the terms """
+    return np.asarray(m.sum(axis=1)).ravel() > 0
+
+def cooccurrence(m):
+    """ Term x term matrix of the number of papers including both """
+    sparse = scipySparse()
+    c = m.T @ m
+    return c.toarray() if sparse is not None and sparse.issparse(c) else np.asarray(c)
+
+def venueYears(names):
+    """ Arrays of the venue and year of each filename from its prefix """
+    parsed = [parseFilename(name) for name in names]
+    venues = np.array([venue for venue, year in parsed], dtype=object)
+    years = pd.array([year for venue, year in parsed], dtype='Int64')
+
+    return venues, years
+
+def paperCube(families, names, allFiles=None):
+    """
+    Number of papers by venue, year, family, and term, from the Filename and
+    Term (if any) columns of each family's data frame, e.g. {'tl': df_tl}.
+    Term '*' counts the papers including any of the family's terms.
+    Filenames are categoricals with the names as categories.
+
+    If allFiles is given, e.g. all the PDFs, those are counted as the
+    family 'all', to know the total papers of each venue and year.
+    """
+    venues, years = venueYears(names)
+    columns = ['Venue', 'Year', 'Family', 'Term', 'Papers']
+    parts = []
+
+    def count(df, family, term=None):
+        keys = ['Venue', 'Year'] + (['Term'] if term is None else [])
+        counts = df.groupby(keys, observed=True, dropna=False)['Filename'] \
+            .nunique().reset_index(name='Papers')
+        counts['Family'] = family
+        if term is not None:
+            counts['Term'] = term
+        return counts[columns]
+
+    for family, df in families.items():
+        codes = df['Filename'].cat.codes.to_numpy()
+        df = pd.DataFrame({
+            'Venue': venues[codes],
+            'Year': years[codes],
+            'Filename': codes,
+            'Term': df['Term'].astype(str).to_numpy() if 'Term' in df else '*',
+        })
+
+        if (df['Term'] != '*').any():
+            parts.append(count(df, family))
+        parts.append(count(df, family, '*'))
+
+    if allFiles is not None:
+        venues, years = venueYears(allFiles)
+        parts.append(count(pd.DataFrame({'Venue': venues, 'Year': years,
+            'Filename': range(len(allFiles))}), 'all', '*'))
+
+    cube = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+    cube['Venue'] = cube['Venue'].fillna('')
+
+    return cube.sort_values(columns[:4], ignore_index=True)
+
+def writeList(filename, lines):
+    """ Write all the lines at once """
+    with open(filename, 'w') as f:
+        f.write(''.join(line+'\n' for line in lines))
 
 def pandasSetPrint():
     """ Make it so we can see the output """
@@ -35,6 +233,8 @@ def pie(fracs, labels=None, save_name=None, pandas=False, figsize=(7,7)):
     If pandas=False:
         pie(fracs, labels, 'pie')
     """
+    plt = pyplot()
+
     if pandas:
         fig = plt.figure()
         df.value_counts().plot.pie(
@@ -62,6 +262,7 @@ def pie(fracs, labels=None, save_name=None, pandas=False, figsize=(7,7)):
 def pieCombined(fracs1, labels1, title1, fracs2, labels2, title2,
         save_name=None, figsize=(10,5)):
     """ Generate and save 2 pie plots together using subplots """
+    plt = pyplot()
     fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=figsize)
     plt.tight_layout()
 
@@ -142,6 +343,7 @@ def autolabel(ax, rects, yerr=None):
                 ha='center', va='bottom')
 
 def barplot(fracs, labels, colors=None, save_name=None):
+    plt = pyplot()
     assert len(fracs) == len(labels)
     #colors = ["xkcd:orange", "xkcd:teal", "xkcd:darkgreen", "xkcd:orchid", "xkcd:blue", "xkcd:indigo"]
     
@@ -153,7 +355,7 @@ def barplot(fracs, labels, colors=None, save_name=None):
     # Plot x values
     i = 0 # We only have one set of bars
     n = len(labels)
-    x = np.array(range(n), dtype=np.float)
+    x = np.array(range(n), dtype=float)
     if colors is not None:
         rects.append(ax.bar(x + i*width + i*margin, fracs, width, color=colors))
     else:
@@ -174,6 +376,18 @@ def barplot(fracs, labels, colors=None, save_name=None):
         plt.savefig(save_name+".pdf", bbox_inches='tight')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a chart from the pdfgrep output")
+    parser.add_argument('--parquet', action='store_true',
+        help="also save the lists as Parquet (requires pyarrow)")
+    parser.add_argument('--plot', action='store_true',
+        help="also make the chart, bar.png and bar.pdf")
+    parser.add_argument('--stats-only', action='store_true',
+        help="only print the counts, don't write the lists")
+    metrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.configure(args.metrics, args.profile)
+
     pandasSetPrint()
 
     # Paths to pdfgrep output
@@ -181,92 +395,114 @@ if __name__ == '__main__':
     grepTL = 'grep/tl.txt'
     grepGen = 'grep/generative.txt'
 
+    # Or output of match_terms.py, where terms are already normalized
+    matches = 'grep/matches.tsv'
+
     # Where to save lists
     listdir = 'list'
 
-    # Read data
-    df_gan = pd.read_csv(grepGAN, sep='\x00', names=['Filename','Match'])
-    df_tl = pd.read_csv(grepTL, sep='\x00', names=['Filename','Term'])
-    df_gen = pd.read_csv(grepGen, sep='\x00', names=['Filename','Term'])
-
-    # Pick one set of TL terms
-    df_tl['Term'] = replace(df_tl['Term'], {
-        'multitask learning':     'multi-task learning',
-        'multi task learning':    'multi-task learning',
-        'multidomain learning':   'multi-domain learning',
-        'multi domain learning':  'multi-domain learning',
-        'self taught learning':   'self-taught learning',
-        'co-variate shift':       'covariate shift',
-        'sample selection bias':  'sample-selection bias',
-        'life long learning':     'life-long learning',
-        })
-
-    # Pick one set of generative terms
-    df_gen['Term'] = replace(df_gen['Term'], {
-        #'image generation':       'image generation',
-        'generation of images':   'image generation',
-        'image synthesis':        'image generation',
-        #'synthesis':              'generation',
-        'super-resolution':       'super resolution',
-        })
-
-    # Ignore some generative terms
-    df_gen = df_gen[
-            (df_gen['Term'].str.lower() != 'image completion') & \
-            (df_gen['Term'].str.lower() != 'semantic segmentation') & \
-            (df_gen['Term'].str.lower() != 'super resolution') & \
-            (df_gen['Term'].str.lower() != 'synthesis') & \
-            (df_gen['Term'].str.lower() != 'style transfer')]
-
-    # "image generation" or "image synthesis" should be included in
-    # "generation", so duplicate (later we'll remove duplicates)
-    rows = df_gen[df_gen['Term'] == 'image generation']
-    rows['Term'] = rows['Term'].str.lower().replace('image generation', 'generation')
-    df_gen = pd.concat([df_gen, rows], ignore_index=True)
-
-    #
-    # Get GAN papers that also mention TL terms
-    #
-    gan = df_gan['Filename'].unique()
-    tl = df_tl['Filename'].unique()
-    gen = df_gen['Filename'].unique()
-    ganCount = len(gan)
-    tlCount = len(tl)
-    genCount = len(gen)
-
-    # Generative terms in GAN papers
-    gen_both = df_gen.loc[df_gen['Filename'].isin(df_gan['Filename'])].drop_duplicates()
-    genPapers = gen_both['Filename'].unique()
-    gangenCount = len(genPapers)
-    gen_terms = gen_both['Term'].unique()
-
-    # Pie chart of how many GAN papers include a mention of each of these terms
-    both = df_tl.loc[df_tl['Filename'].isin(df_gan['Filename'])].drop_duplicates()
-    tlPapers = both['Filename'].unique()
-    gantlCount = len(tlPapers)
-    terms = both['Term'].unique()
-
-    termCounts = {}
-    for t in terms: # TL
-        termCounts[t] = 0
-    for t in gen_terms: # Generative
-        termCounts[t] = 0
-
-    for p in tlPapers: # TL
-        for t in both[both['Filename']==p]['Term']:
-            termCounts[t] += 1
-    for p in genPapers: # Generative
-        for t in gen_both[gen_both['Filename']==p]['Term']:
-            termCounts[t] += 1
-
-    fracs = [c/ganCount for c in termCounts.values()]
-    labels = termCounts.keys()
-    labels = [cap(l) for l in labels]
-    fracs, labels = zip(*sorted(zip(fracs, labels), reverse=True)) # Sort
-    #pie(fracs, labels, "pie")
-    # See: https://matplotlib.org/users/dflt_style_changes.html
-    colors = ['#1f77b4' if l.lower() in gen_terms else '#d62728' for l in labels]
-    barplot([f*100 for f in fracs], labels, colors, save_name="bar")
+    # To count all the papers, not only those including terms
+    pdfdir = 'pdfs'
+
+    with metrics.stage('read') as stage:
+        # Read data, all sharing the same filename ids
+        files = {}
+
+        if os.path.exists(matches):
+            families = readMatches(matches, files)
+            empty = pd.DataFrame(columns=['File','Term'])
+            df_gan = families.get('gan', empty)[['File']].drop_duplicates()
+            df_tl = families.get('tl', empty)
+            df_gen = families.get('generative', empty)
+        else:
+            # Only the filenames matter for GAN papers
+            df_gan = readGrep(grepGAN, files, terms=False)
+
+            # Pick one set of TL terms
+            df_tl = readGrep(grepTL, files, {
+                'multitask learning':     'multi-task learning',
+                'multi task learning':    'multi-task learning',
+                'multidomain learning':   'multi-domain learning',
+                'multi domain learning':  'multi-domain learning',
+                'self taught learning':   'self-taught learning',
+                'co-variate shift':       'covariate shift',
+                'sample selection bias':  'sample-selection bias',
+                'life long learning':     'life-long learning',
+                })
+
+            # Pick one set of generative terms
+            df_gen = readGrep(grepGen, files, {
+                #'image generation':       'image generation',
+                'generation of images':   'image generation',
+                'image synthesis':        'image generation',
+                #'synthesis':              'generation',
+                'super-resolution':       'super resolution',
+                })
+
+        # Ignore some generative terms
+        df_gen = df_gen[~df_gen['Term'].isin([
+                'image completion',
+                'semantic segmentation',
+                'super resolution',
+                'synthesis',
+                'style transfer'])]
+
+        # "image generation" or "image synthesis" should be included in
+        # "generation", so duplicate (later we'll remove duplicates)
+        rows = df_gen[df_gen['Term'] == 'image generation'].assign(Term='generation')
+        df_gen = pd.concat([df_gen, rows], ignore_index=True)
+
+        # Filenames and terms as categoricals
+        names, remap = sortedFiles(files)
+        df_gan = toCategorical(df_gan, names, remap)
+        df_tl = toCategorical(df_tl, names, remap)
+        df_gen = toCategorical(df_gen, names, remap)
+        stage.items = len(names)
+
+    with metrics.stage('count') as stage:
+        #
+        # Get GAN papers that also mention TL terms
+        #
+        gan = df_gan['Filename'].unique()
+        tl = df_tl['Filename'].unique()
+        gen = df_gen['Filename'].unique()
+        ganCount = len(gan)
+        tlCount = len(tl)
+        genCount = len(gen)
+
+        # Generative terms in GAN papers
+        gen_both = df_gen.loc[df_gen['Filename'].isin(df_gan['Filename'])].drop_duplicates()
+        gen_terms = gen_both['Term'].unique()
+
+        # Pie chart of how many GAN papers include a mention of each of these terms
+        both = df_tl.loc[df_tl['Filename'].isin(df_gan['Filename'])].drop_duplicates()
+        tlPapers = both['Filename'].unique()
+        terms = both['Term'].unique()
+
+        # GAN paper x term matrices, so counts and overlaps are matrix operations
+        # rather than filtering the whole data frame for each paper
+        allTerms = list(terms) + list(gen_terms)
+        tlMatrix = incidence(both, gan, terms)
+        genMatrix = incidence(gen_both, gan, gen_terms)
+        matrix = incidence(pd.concat([both, gen_both]), gan, allTerms)
+
+        gantlCount = int(anyTerm(tlMatrix).sum())
+        gangenCount = int(anyTerm(genMatrix).sum())
+        termCounts = dict(zip(allTerms, columnSums(matrix)))
+        termOverlap = pd.DataFrame(cooccurrence(matrix), index=allTerms, columns=allTerms)
+        stage.items = ganCount
+
+        fracs = [c/ganCount for c in termCounts.values()]
+        labels = termCounts.keys()
+        labels = [cap(l) for l in labels]
+        fracs, labels = zip(*sorted(zip(fracs, labels), reverse=True)) # Sort
+
+    if args.plot:
+        with metrics.stage('plot'):
+            #pie(fracs, labels, "pie")
+            # See: https://matplotlib.org/users/dflt_style_changes.html
+            colors = ['#1f77b4' if l.lower() in gen_terms else '#d62728' for l in labels]
+            barplot([f*100 for f in fracs], labels, colors, save_name="bar")
 
     # Print counts of papers
     print("GAN Papers:", ganCount)
@@ -295,33 +531,59 @@ if __name__ == '__main__':
     #        fracs, labels, title2,
     #        "pie")
 
-    #
-    # Output filenames for each of them
-    #
-    if not os.path.exists(listdir):
-        os.makedirs(listdir)
-
-    with open(os.path.join(listdir, 'gan.txt'), 'w') as f:
-        for e in gan:
-            f.write(e+'\n')
-    with open(os.path.join(listdir, 'tl.txt'), 'w') as f:
-        for e in tl:
-            f.write(e+'\n')
-    with open(os.path.join(listdir, 'generative.txt'), 'w') as f:
-        for e in gen:
-            f.write(e+'\n')
-
-    # When a single PDF (multiple rows) has multiple terms, join them to be
-    # like: ("pdfName", "term1, term2, term3")
-    tl_grouped = df_tl.drop_duplicates().groupby('Filename').apply(lambda x: pd.Series({
-            'Term': ', '.join(x['Term'].sort_values())
-        })).reset_index()
-    tl_both_grouped = tl_grouped.loc[tl_grouped['Filename'].isin(df_gan['Filename'])].drop_duplicates()
-    assert len(tl_both_grouped) == len(tlPapers), "Somehow tl_grouped length different than overlap papers length"
-
-    with open(os.path.join(listdir, 'overlap.txt'), 'w') as f:
-        for index, row in tl_both_grouped.iterrows():
-            f.write(row['Filename']+'\t'+row['Term']+'\n')
+    if not args.stats_only:
+        with metrics.stage('lists') as stage:
+            #
+            # Output filenames for each of them
+            #
+            if not os.path.exists(listdir):
+                os.makedirs(listdir)
+
+            writeList(os.path.join(listdir, 'gan.txt'), gan)
+            writeList(os.path.join(listdir, 'tl.txt'), tl)
+            writeList(os.path.join(listdir, 'generative.txt'), gen)
+
+            # Number of GAN papers including both terms
+            termOverlap.to_csv(os.path.join(listdir, 'cooccurrence.txt'), sep='\t')
+
+            # When a single PDF (multiple rows) has multiple terms, join them to be
+            # like: ("pdfName", "term1, term2, term3"). As strings, since if each
+            # has only one term, the joined column stays categorical.
+            tl_both_grouped = both.sort_values('Term') \
+                .assign(Term=lambda df: df['Term'].astype(str)) \
+                .groupby('Filename', observed=True)['Term'] \
+                .agg(', '.join).reset_index()
+            assert len(tl_both_grouped) == len(tlPapers), "Somehow tl_grouped length different than overlap papers length"
+
+            writeList(os.path.join(listdir, 'overlap.txt'),
+                tl_both_grouped['Filename'].astype(str) + '\t' + tl_both_grouped['Term'])
+
+            # Also save as Parquet if desired
+            if args.parquet:
+                pd.DataFrame({'Filename': gan}).to_parquet(os.path.join(listdir, 'gan.parquet'))
+                pd.DataFrame({'Filename': tl}).to_parquet(os.path.join(listdir, 'tl.parquet'))
+                pd.DataFrame({'Filename': gen}).to_parquet(os.path.join(listdir, 'generative.parquet'))
+                tl_both_grouped.to_parquet(os.path.join(listdir, 'overlap.parquet'))
+
+            stage.items = len(gan) + len(tl) + len(gen) + len(tl_both_grouped)
+
+        # Paper counts by venue, year, and term for breakdown.py
+        with metrics.stage('cube') as stage:
+            pdfs = [entry.name for entry in os.scandir(pdfdir)
+                if entry.name.endswith('.pdf')] if os.path.isdir(pdfdir) else None
+            cube = paperCube({
+                'gan': df_gan,
+                'tl': df_tl,
+                'generative': df_gen,
+                'gan+tl': both,
+                'gan+generative': gen_both,
+            }, names, pdfs)
+            cube.to_csv(os.path.join(listdir, 'cube.csv'), index=False)
+
+            if args.parquet:
+                cube.to_parquet(os.path.join(listdir, 'cube.parquet'))
+
+            stage.items = len(cube)
 
     """
     pie(both['Term'], save_name='pie', pandas=True)
@@ -330,3 +592,5 @@ if __name__ == '__main__':
     #
     pie(both['Term'], save_name='pie_set', pandas=True)
     """
+
+    metrics.save()
@@ -0,0 +1,312 @@
+"""
+Pooled HTTP client for downloading the papers
+
+Keeps idle keep-alive connections around for each host so that downloading
+thousands of PDFs from the same handful of sites doesn't require a new TCP and
+TLS handshake for every file. Optionally uses HTTP/2 if httpx is installed.
+
+Usage:
+    client = HTTPClient(poolSize=4)
+    with client.open("https://papers.nips.cc/...") as response:
+        data = response.read()
+"""
+import ssl
+import threading
+import http.client
+import urllib.error
+from urllib.parse import urlparse, urljoin
+
+import metrics
+
+# Errors indicating an idle keep-alive connection was closed by the server
+# while it was in the pool, in which case we retry on a new connection
+staleErrors = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+    ConnectionResetError, BrokenPipeError)
+
+redirectCodes = (301, 302, 303, 307, 308)
+
+class HostPool:
+    """
+    Idle connections to one host (scheme, host, port). At most size connections
+    are in use at once; acquire() blocks until one is available.
+    """
+    def __init__(self, scheme, netloc, size=4, timeout=60, context=None):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.context = context
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def newConnection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc,
+                timeout=self.timeout, context=self.context)
+        else:
+            return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def acquire(self):
+        """ Returns (connection, whether it was reused from the pool) """
+        self.slots.acquire()
+
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+
+        return self.newConnection(), False
+
+    def release(self, conn, reuse=True):
+        if reuse:
+            with self.lock:
+                self.idle.append(conn)
+        else:
+            conn.close()
+
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+class Response:
+    """
+    Response from HTTPClient.open(). Returns the connection to the pool once
+    closed if the body was read fully and the server allows keep-alive.
+    """
+    def __init__(self, url, response, pool, conn):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.response = response
+        self.pool = pool
+        self.conn = conn
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def close(self):
+        if self.conn is None:
+            return
+
+        reuse = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.pool.release(self.conn, reuse)
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HTTP2Response:
+    """
+    Same interface as Response but for an httpx streaming response. Frees the
+    request's slot in the host's pool once closed.
+    """
+    def __init__(self, url, response, pool):
+        self.url = url
+        self.status = response.status_code
+        self.reason = response.reason_phrase
+        self.headers = response.headers
+        self.response = response
+        self.pool = pool
+        self.chunks = response.iter_raw()
+        self.buffer = b''
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self.buffer + b''.join(self.chunks)
+            self.buffer = b''
+            return data
+
+        while len(self.buffer) < amt:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        data, self.buffer = self.buffer[:amt], self.buffer[amt:]
+        return data
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def close(self):
+        if self.pool is None:
+            return
+
+        self.response.close()
+        self.pool.slots.release()
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HTTPClient:
+    """
+    Keep-alive connection pool per host, following redirects and raising
+    urllib.error.HTTPError on errors like urllib.request.urlopen does.
+
+    poolSize -- max simultaneous connections to each host
+    http2 -- use HTTP/2 via httpx (pip install httpx[http2]) if available
+    """
+    def __init__(self, poolSize=4, timeout=60, http2=False, maxRedirects=10):
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.maxRedirects = maxRedirects
+        self.context = ssl.create_default_context()
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.session = None
+
+        if http2:
+            try:
+                import httpx
+
+                # The limits of httpx are for all hosts together, so the
+                # number of requests to each host is limited by its HostPool
+                self.session = httpx.Client(http2=True, timeout=timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=None,
+                        max_keepalive_connections=poolSize))
+            except ImportError:
+                print("Warning: httpx[http2] not installed, using HTTP/1.1")
+
+    def getPool(self, scheme, netloc):
+        key = (scheme, netloc.lower())
+
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = HostPool(scheme, netloc, self.poolSize,
+                    self.timeout, self.context)
+
+            return self.pools[key]
+
+    def request(self, url, headers):
+        """ Make a single request, not following redirects """
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        pool = self.getPool(parsed.scheme, parsed.netloc)
+        conn, reused = pool.acquire()
+
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except staleErrors:
+            pool.release(conn, reuse=False)
+
+            if not reused:
+                raise
+
+            # The server closed the idle connection, so try a fresh one
+            metrics.inc('http_retries_total', host=parsed.netloc.lower())
+            conn, _ = pool.acquire()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except BaseException:
+                pool.release(conn, reuse=False)
+                raise
+        except BaseException:
+            pool.release(conn, reuse=False)
+            raise
+
+        return Response(url, response, pool, conn)
+
+    def open(self, url, headers=None):
+        """
+        GET url, returning a Response that must be closed (or used with
+        "with") to return the connection to the pool
+        """
+        headers = dict(headers or {})
+
+        if self.session is not None:
+            # We save the body as is, so it must not be compressed, and then
+            # its length also matches Content-Length and Range offsets
+            headers.setdefault('Accept-Encoding', 'identity')
+
+            parsed = urlparse(url)
+            pool = self.getPool(parsed.scheme, parsed.netloc)
+            pool.slots.acquire()
+
+            try:
+                response = self.session.send(
+                    self.session.build_request('GET', url, headers=headers),
+                    stream=True)
+            except BaseException:
+                pool.slots.release()
+                raise
+
+            if response.status_code >= 400:
+                response.close()
+                pool.slots.release()
+                raise urllib.error.HTTPError(str(response.url),
+                    response.status_code, response.reason_phrase,
+                    response.headers, None)
+            return HTTP2Response(str(response.url), response, pool)
+
+        for i in range(self.maxRedirects+1):
+            response = self.request(url, headers)
+
+            if response.status in redirectCodes and response.getheader('Location'):
+                location = response.getheader('Location')
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status,
+                    response.reason, response.headers, None)
+
+            return response
+
+        raise urllib.error.HTTPError(url, 310, "Too many redirects", None, None)
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
+
+            if self.session is not None:
+                self.session.close()
+
+# Shared by downloadFile() and getLinks() unless another client is passed in
+defaultClient = None
+defaultLock = threading.Lock()
+
+def configure(**kwargs):
+    """ Set the options for the shared client, e.g. configure(poolSize=8) """
+    global defaultClient
+
+    with defaultLock:
+        if defaultClient is not None:
+            defaultClient.close()
+        defaultClient = HTTPClient(**kwargs)
+
+    return defaultClient
+
+def getClient():
+    global defaultClient
+
+    with defaultLock:
+        if defaultClient is None:
+            defaultClient = HTTPClient()
+
+        return defaultClient
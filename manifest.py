@@ -0,0 +1,327 @@
+"""
+Manifest of the files to download, stored in SQLite and keyed by URL
+
+Records where each URL is saved, its size, hash, HTTP status, ETag and
+Last-Modified headers, and how many times it failed. Rather than checking if
+every file exists and whether it is in error.txt, the files left to download
+are then a single query. Failed downloads are retried later with exponential
+backoff instead of being skipped forever.
+
+The same paper is sometimes listed under multiple URLs (e.g. JMLR volumes that
+span years). Only the first file with each SHA-256 is kept. The others are
+recorded as aliases of it rather than stored and searched again.
+
+Which files were checked to really be PDFs (see verify_pdfs.py) is kept too,
+so only new or changed files are checked again.
+"""
+import os
+import time
+import sqlite3
+import threading
+from hashlib import sha256
+
+schema = """
+CREATE TABLE IF NOT EXISTS downloads (
+    url TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending', -- pending, done, or failed
+    size INTEGER,
+    sha256 TEXT,
+    http_status INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    retries INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_todo ON downloads(state, next_attempt);
+CREATE INDEX IF NOT EXISTS downloads_filename ON downloads(filename);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    filename TEXT NOT NULL, -- canonical copy
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS blobs_filename ON blobs(filename);
+CREATE TABLE IF NOT EXISTS aliases (
+    filename TEXT PRIMARY KEY, -- not stored, same as the blob's file
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS aliases_sha256 ON aliases(sha256);
+CREATE TABLE IF NOT EXISTS verified (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL, -- nanoseconds
+    version INTEGER NOT NULL -- of the checks
+);
+"""
+
+def sha256sum(filename, chunkSize=1024*1024):
+    h = sha256()
+
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+class Manifest:
+    """
+    Download manifest. Safe to use from multiple threads.
+
+    backoff -- seconds to wait before the first retry, multiplied by
+        backoffFactor after each additional failure
+    maxRetries -- give up on a URL after this many failures
+    """
+    def __init__(self, filename='manifest.sqlite', backoff=60, backoffFactor=4,
+            maxRetries=8):
+        self.backoff = backoff
+        self.backoffFactor = backoffFactor
+        self.maxRetries = maxRetries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(schema)
+
+    def add(self, toDownload, downloaddir, errors=None):
+        """
+        Add (url, filename) pairs not yet in the manifest. New entries that
+        were already downloaded (found with one directory listing rather than
+        checking each file) or are aliases of another file are marked done,
+        and those in the old errors file are marked as having failed once.
+        """
+        now = time.time()
+
+        with self.lock:
+            known = set(url for url, in self.db.execute("SELECT url FROM downloads"))
+            new = [(url, fname) for url, fname in toDownload if url not in known]
+
+            if not new:
+                return 0
+
+            existing = {}
+            if os.path.exists(downloaddir):
+                for entry in os.scandir(downloaddir):
+                    if entry.is_file():
+                        existing[entry.path] = entry.stat().st_size
+
+            for fname, size in self.db.execute("""SELECT aliases.filename, size
+                    FROM aliases JOIN blobs USING (sha256)"""):
+                existing[fname] = size
+
+            error_files = set()
+            if errors is not None and os.path.exists(errors):
+                with open(errors, 'r') as f:
+                    error_files = set(line.strip() for line in f)
+
+            rows = []
+            for url, fname in new:
+                if fname in existing:
+                    rows.append((url, fname, 'done', existing[fname], 0, 0, now, now))
+                elif url in error_files:
+                    rows.append((url, fname, 'failed', None, 1,
+                        now + self.backoff, now, now))
+                else:
+                    rows.append((url, fname, 'pending', None, 0, 0, now, now))
+
+            with self.db:
+                self.db.executemany("""INSERT OR IGNORE INTO downloads
+                    (url, filename, state, size, retries, next_attempt, created, updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+
+            return len(rows)
+
+    def pending(self, urls=None):
+        """
+        (url, filename) of files to download now, only of those urls if given,
+        e.g. the papers of the venues being downloaded
+        """
+        with self.lock:
+            rows = self.db.execute("""SELECT url, filename FROM downloads
+                WHERE state != 'done' AND retries < ? AND next_attempt <= ?""",
+                (self.maxRetries, time.time())).fetchall()
+
+        if urls is not None:
+            urls = set(urls)
+            rows = [(url, fname) for url, fname in rows if url in urls]
+
+        return rows
+
+    def completedSince(self, since):
+        """ (filename, time) of files downloaded after the time since """
+        with self.lock:
+            return self.db.execute("""SELECT filename, updated FROM downloads
+                WHERE state = 'done' AND updated > ? ORDER BY updated""",
+                (since,)).fetchall()
+
+    def recheck(self, downloaddir):
+        """ Mark files as pending again if they were deleted from downloaddir """
+        existing = set()
+        if os.path.exists(downloaddir):
+            existing = set(entry.path for entry in os.scandir(downloaddir))
+
+        with self.lock:
+            existing.update(fname for fname, in self.db.execute(
+                "SELECT filename FROM aliases"))
+
+            missing = [(url,) for url, fname in self.db.execute(
+                "SELECT url, filename FROM downloads WHERE state = 'done'")
+                if fname not in existing]
+
+            with self.db:
+                self.db.executemany("""UPDATE downloads SET state = 'pending',
+                    updated = ? WHERE url = ?""",
+                    [(time.time(), url) for url, in missing])
+
+            return len(missing)
+
+    def markDone(self, url, info=None):
+        """ Record a successful download, info as returned by downloadFile() """
+        with self.lock, self.db:
+            # Already existed, so we don't know anything more about it
+            if info is None:
+                self.db.execute("""UPDATE downloads SET state = 'done',
+                    updated = ? WHERE url = ?""", (time.time(), url))
+                return
+
+            self.db.execute("""UPDATE downloads SET state = 'done', size = ?,
+                sha256 = ?, http_status = ?, etag = ?, last_modified = ?,
+                updated = ? WHERE url = ?""",
+                (info.get('size'), info.get('sha256'), info.get('status'),
+                    info.get('etag'), info.get('last_modified'), time.time(), url))
+
+    def markFailed(self, url, status=None):
+        """ Record a failure, scheduling a retry after an increasing delay """
+        now = time.time()
+
+        with self.lock, self.db:
+            retries, = self.db.execute("SELECT retries FROM downloads WHERE url = ?",
+                (url,)).fetchone() or (0,)
+            delay = self.backoff * self.backoffFactor**retries
+
+            self.db.execute("""UPDATE downloads SET state = 'failed',
+                http_status = ?, retries = ?, next_attempt = ?, updated = ?
+                WHERE url = ?""", (status, retries+1, now+delay, now, url))
+
+    def addBlob(self, filename, sha256, size=None):
+        """
+        Record the file's hash. Returns the canonical filename with that hash,
+        which is filename unless it's a duplicate.
+        """
+        with self.lock, self.db:
+            self.db.execute("""INSERT OR IGNORE INTO blobs (sha256, filename, size)
+                VALUES (?, ?, ?)""", (sha256, filename, size))
+            canonical, = self.db.execute("SELECT filename FROM blobs WHERE sha256 = ?",
+                (sha256,)).fetchone()
+
+            return canonical
+
+    def addAlias(self, filename, sha256):
+        """ Record that filename has the same contents as the blob sha256 """
+        with self.lock, self.db:
+            self.db.execute("""INSERT OR REPLACE INTO aliases (filename, sha256)
+                VALUES (?, ?)""", (filename, sha256))
+
+    def removeBlob(self, sha256):
+        """ The canonical file was deleted, so forget it and its aliases """
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self.db.execute("DELETE FROM aliases WHERE sha256 = ?", (sha256,))
+
+    def duplicateOf(self, filename, sha256, size=None):
+        """
+        If another file with this hash exists, record filename as an alias and
+        return the other file, which the caller should then delete filename in
+        favor of. Otherwise, filename becomes the canonical copy and this
+        returns None.
+        """
+        canonical = self.addBlob(filename, sha256, size)
+
+        if canonical == filename:
+            return None
+
+        if not os.path.exists(canonical):
+            # The canonical copy was deleted, so this is it now
+            self.removeBlob(sha256)
+            self.addBlob(filename, sha256, size)
+            return None
+
+        self.addAlias(filename, sha256)
+        return canonical
+
+    def aliases(self):
+        """ Dictionary from each alias filename to its canonical filename """
+        with self.lock:
+            return dict(self.db.execute("""SELECT aliases.filename, blobs.filename
+                FROM aliases JOIN blobs USING (sha256)"""))
+
+    def hashes(self):
+        """ Dictionary from filename to (size, sha256) for downloaded files """
+        with self.lock:
+            return dict((fname, (size, h)) for fname, size, h in self.db.execute(
+                """SELECT filename, size, sha256 FROM downloads
+                WHERE state = 'done' AND sha256 IS NOT NULL"""))
+
+    def verified(self):
+        """ Dictionary from filename to (size, mtime, version) of verified files """
+        with self.lock:
+            return dict((fname, (size, mtime, version)) for fname, size, mtime, version
+                in self.db.execute("SELECT * FROM verified"))
+
+    def setVerified(self, files):
+        """ Record (filename, size, mtime, version) of files that were verified """
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?)",
+                files)
+
+    def downloaded(self, filenames):
+        """ Set of the filenames that were downloaded from a URL we know """
+        with self.lock:
+            return set(fname for fname in set(filenames) if self.db.execute(
+                "SELECT 1 FROM downloads WHERE filename = ?", (fname,)).fetchone())
+
+    def requeue(self, filenames):
+        """
+        Download the files again, e.g. they were an error page rather than a
+        PDF. Files with the same contents (aliases) are downloaded again too,
+        and each counts as a retry so a URL that always returns the wrong
+        thing is eventually given up on. Returns how many URLs were requeued.
+        """
+        if not filenames:
+            return 0
+
+        now = time.time()
+        filenames = list(filenames)
+
+        with self.lock, self.db:
+            hashes = [h for fname in filenames for h, in self.db.execute(
+                "SELECT sha256 FROM blobs WHERE filename = ?", (fname,))]
+            filenames += [fname for h in hashes for fname, in self.db.execute(
+                "SELECT filename FROM aliases WHERE sha256 = ?", (h,))]
+
+            urls = [url for fname in set(filenames) for url, in self.db.execute(
+                "SELECT url FROM downloads WHERE filename = ?", (fname,))]
+
+            self.db.executemany("""UPDATE downloads SET state = 'pending',
+                size = NULL, sha256 = NULL, retries = retries + 1,
+                next_attempt = 0, updated = ? WHERE url = ?""",
+                [(now, url) for url in urls])
+            self.db.executemany("DELETE FROM blobs WHERE sha256 = ?",
+                [(h,) for h in hashes])
+            self.db.executemany("DELETE FROM aliases WHERE sha256 = ?",
+                [(h,) for h in hashes])
+            self.db.executemany("DELETE FROM verified WHERE filename = ?",
+                [(fname,) for fname in set(filenames)])
+
+            return len(urls)
+
+    def counts(self):
+        """ Number of files in each state """
+        with self.lock:
+            return dict(self.db.execute(
+                "SELECT state, COUNT(*) FROM downloads GROUP BY state"))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Find the GAN, TL, and generative terms in the extracted text
+
+Does what the three pdfgrep runs in grep_pdfs.sh do, but on the text extracted
+once rather than parsing every PDF three times. Each family's terms are
+compiled into one regex with a named group per term, so each text is scanned
+once per family (three times), not once per term. The families can't share
+one scan: a match of one family (e.g. "style transfer") would consume text
+that a match of another family overlaps ("transfer learning") and hide it,
+while pdfgrep finds both. Matches are normalized to one spelling per term
+(e.g. "multitask learning" is counted as "multi-task learning") as they're
+found.
+
+If corpus.bin from corpus_store.py is up to date for a paper, its text is
+searched there in parallel rather than read from text.sqlite. Since that is a
+bytes regex, letters are only matched case insensitively in ASCII.
+
+Matches are saved per paper in matches.sqlite along with the hash of the PDF,
+the version of the extracted text, and a hash of each family's patterns. Each
+run only searches papers that are new or changed, and only for the families
+whose patterns changed, so adding a venue or a term doesn't mean searching
+everything again.
+
+Each match also records which section it's in (front matter, abstract, body,
+or references, as found when extracting). The output can be limited to a page
+range or sections, e.g. --page-range 1-2 or --section abstract, which only
+filters the saved matches rather than searching again, so different ways to
+exclude matches only in citations are cheap to compare.
+
+Outputs grep/matches.tsv with one row per match (filename, family, term, page,
+offset, section) as well as grep/{gan,tl,generative}.txt in the same format as
+pdfgrep.
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from hashlib import md5
+
+import metrics
+from extract_text import TextStore, sectionOf, sectionVersion, sections
+from corpus_store import Corpus, scan
+
+# GAN Terms
+#  - generative adversarial net(s)
+#  - generative adversarial network(s)
+#  - GAN(s)
+gan = [
+    ('GAN', r'[Gg]enerative [Aa]dversarial|GANs|\ GAN[\ ,\.-]'),
+]
+
+# TL-Related Terms, as (the spelling we use, regex of all the spellings)
+tl = [
+    ('transfer learning',     r'transfer learning'),
+    ('domain adaptation',     r'domain adaptation'),
+    ('domain generalization', r'domain generalization'),
+    ('multi-task learning',   r'multi[-\ ]?task learning'),
+    ('multi-domain learning', r'multi[-\ ]?domain learning'),
+    ('self-taught learning',  r'self[-\ ]taught learning'),
+    ('covariate shift',       r'co-?variate shift'),
+    ('sample-selection bias', r'sample[-\ ]selection bias'),
+    ('life-long learning',    r'life[-\ ]long learning'),
+    ('inductive bias',        r'inductive bias'),
+]
+
+# Generative-Related Terms
+#  - "generation" should indicate use for any generative thing (images,
+#    samples, ...), so it's after "image generation" so that one matches first
+gen = [
+    ('image generation',      r'image generation|generation of images|image synthesis'),
+    ('super resolution',      r'super[-\ ]resolution'),
+    ('image completion',      r'image completion'),
+    ('semantic segmentation', r'semantic segmentation'),
+    ('style transfer',        r'style transfer'),
+    ('generation',            r'generation'),
+    ('synthesis',             r'synthesis'),
+]
+
+# Family name: (terms, whether case insensitive)
+families = {
+    'gan': (gan, False),
+    'tl': (tl, True),
+    'generative': (gen, True),
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS state (
+    filename TEXT NOT NULL,
+    family TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    extract_version TEXT NOT NULL,
+    pattern_version TEXT NOT NULL,
+    PRIMARY KEY (filename, family)
+);
+CREATE TABLE IF NOT EXISTS matches (
+    filename TEXT NOT NULL,
+    family TEXT NOT NULL,
+    term TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    section TEXT
+);
+CREATE INDEX IF NOT EXISTS matches_file ON matches(filename, family);
+"""
+
+# Increment when changing how the patterns are searched so they're searched again
+matchVersion = 2
+
+def patternVersion(family, pages, families=families):
+    """
+    Changes if the patterns of the family, pages searched, or how sections are
+    found change
+    """
+    terms, ignorecase = families[family]
+    return md5(json.dumps([terms, ignorecase, pages, sectionVersion, matchVersion])
+        .encode('utf-8')).hexdigest()
+
+def openMatches(dbFile='matches.sqlite'):
+    db = sqlite3.connect(dbFile)
+    db.executescript(schema)
+
+    # Created before sections were saved, which are then all searched again
+    # since the pattern versions changed
+    columns = [row[1] for row in db.execute("PRAGMA table_info(matches)")]
+    if 'section' not in columns:
+        with db:
+            db.execute("ALTER TABLE matches ADD COLUMN section TEXT")
+
+    return db
+
+class TermMatcher:
+    """
+    One regex for all the terms of each family. The text is scanned once for
+    each family, since with all the families in one regex their matches
+    could hide each other's when they overlap.
+    """
+    def __init__(self, families=families):
+        self.groups = []
+        self.regexes = []
+
+        for family, (terms, ignorecase) in families.items():
+            parts = []
+
+            for term, regex in terms:
+                name = 't%d' % len(self.groups)
+                flags = '?i:' if ignorecase else '?:'
+                parts.append('(?P<%s>(%s%s))' % (name, flags, regex))
+                self.groups.append((family, term))
+
+            self.regexes.append(re.compile('|'.join(parts)))
+
+    def bytesPatterns(self):
+        """ The regex of each family for searching UTF-8 bytes, e.g. in the corpus """
+        return [regex.pattern.encode('utf-8') for regex in self.regexes]
+
+    def match(self, pages):
+        """ List of (family, term, page, offset) in the list of pages """
+        found = []
+
+        for page, text in enumerate(pages, 1):
+            for regex in self.regexes:
+                for m in regex.finditer(text):
+                    family, term = self.groups[int(m.lastgroup[1:])]
+                    found.append((family, term, page, m.start()))
+
+        return found
+
+def updateMatches(storeFile='text.sqlite', dbFile='matches.sqlite', pages=3,
+        families=families, full=False, corpusFile=None, processes=None):
+    """
+    Search the papers that are new or changed (or all of them if full=True)
+    for the families that changed, saving the results in dbFile. Papers that
+    are up to date in the corpus, if given, are searched there. Returns the
+    number of papers searched.
+    """
+    store = TextStore(storeFile)
+    db = openMatches(dbFile)
+
+    corpus = None
+    if corpusFile is not None and os.path.exists(corpusFile + '.json'):
+        corpus = Corpus(corpusFile)
+
+        # Doesn't have all the pages we're searching
+        if corpus.pages < pages:
+            corpus.close()
+            corpus = None
+
+    versions = dict((family, patternVersion(family, pages, families))
+        for family in families)
+    state = {}
+
+    if not full:
+        for fname, family, h, ev, pv in db.execute("SELECT * FROM state"):
+            state[(fname, family)] = (h, ev, pv)
+
+    # Papers to search for each combination of families that need searching
+    todo = {}
+    current = set()
+    searched = 0
+
+    for fname, h, ev in store.files():
+        current.add(fname)
+        stale = tuple(family for family in families
+            if state.get((fname, family)) != (h, ev, versions[family]))
+
+        if stale:
+            todo.setdefault(stale, []).append((fname, h, ev))
+
+    with db:
+        for stale, papers in todo.items():
+            matcher = TermMatcher(dict((f, families[f]) for f in stale))
+            rows = []
+            inCorpus = {}
+
+            if corpus is not None:
+                for fname, h, ev in papers:
+                    doc = corpus.current(fname, h, ev)
+                    if doc is not None:
+                        inCorpus[doc] = fname
+
+                starts = dict((doc, store.getSections(corpus.sha256[doc]))
+                    for doc in inCorpus)
+
+                for pattern in matcher.bytesPatterns():
+                    for doc, page, offset, group in scan(corpus, corpusFile,
+                            pattern, inCorpus, processes):
+                        if page <= pages:
+                            family, term = matcher.groups[int(group[1:])]
+                            rows.append((inCorpus[doc], family, term, page, offset,
+                                sectionOf(starts[doc], page, offset)))
+
+            searchedCorpus = set(inCorpus.values())
+
+            for fname, h, ev in papers:
+                if fname not in searchedCorpus:
+                    text = store.getHash(h)
+                    starts = store.getSections(h, text)
+                    rows += [(fname, family, term, page, offset,
+                        sectionOf(starts, page, offset)) for family, term, page, offset
+                        in matcher.match(text[:pages])]
+
+            rows.sort(key=lambda r: (r[0], r[3], r[4], r[1]))
+
+            db.executemany("DELETE FROM matches WHERE filename = ? AND family = ?",
+                [(fname, family) for fname, h, ev in papers for family in stale])
+            db.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?)",
+                [(fname, family, h, ev, versions[family])
+                    for fname, h, ev in papers for family in stale])
+            searched += len(papers)
+
+        # Forget papers that were deleted and families no longer searched for
+        for fname, family in list(db.execute("SELECT filename, family FROM state")):
+            if fname not in current or family not in families:
+                db.execute("DELETE FROM matches WHERE filename = ? AND family = ?",
+                    (fname, family))
+                db.execute("DELETE FROM state WHERE filename = ? AND family = ?",
+                    (fname, family))
+
+    db.close()
+    store.close()
+
+    if corpus is not None:
+        corpus.close()
+
+    return searched
+
+def savedMatches(dbFile='matches.sqlite'):
+    """ All the saved matches, sorted """
+    db = openMatches(dbFile)
+    rows = db.execute("""SELECT filename, family, term, page, offset, section
+        FROM matches ORDER BY filename, page, offset, family, term""").fetchall()
+    db.close()
+    return rows
+
+def checkMatches(storeFile='text.sqlite', dbFile='matches.sqlite', pages=3,
+        families=families, corpusFile=None, processes=None):
+    """
+    Search everything again into a temporary database and compare with the
+    saved (incrementally updated) matches. Returns (missing, extra), the rows
+    only found by searching everything and only saved.
+    """
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        fullFile = os.path.join(tmpdir, 'matches.sqlite')
+        updateMatches(storeFile, fullFile, pages, families, True, corpusFile, processes)
+        full = savedMatches(fullFile)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    saved = savedMatches(dbFile)
+    fullSet, savedSet = set(full), set(saved)
+
+    return [r for r in full if r not in savedSet], [r for r in saved if r not in fullSet]
+
+def exportMatches(dbFile='matches.sqlite', outdir='grep', pageRange=None,
+        sections=None):
+    """
+    Write the saved matches to outdir for generate_chart.py, only those in
+    the pageRange (first, last) and sections if given
+    """
+    db = openMatches(dbFile)
+    where = []
+    params = []
+
+    if pageRange is not None:
+        where.append("page BETWEEN ? AND ?")
+        params += pageRange
+
+    if sections is not None:
+        where.append("section IN (%s)" % ', '.join('?'*len(sections)))
+        params += sections
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # Same format as pdfgrep -Z for generate_chart.py
+    outputs = dict((family, open(os.path.join(outdir, family+'.txt'), 'w'))
+        for family, in db.execute("SELECT DISTINCT family FROM state"))
+    count = 0
+
+    with open(os.path.join(outdir, 'matches.tsv'), 'w') as f:
+        f.write('Filename\tFamily\tTerm\tPage\tOffset\tSection\n')
+
+        for fname, family, term, page, offset, section in db.execute("""SELECT
+                filename, family, term, page, offset, section FROM matches """
+                + ("WHERE " + " AND ".join(where) if where else "")
+                + " ORDER BY filename, page, offset, family, term", params):
+            f.write('%s\t%s\t%s\t%d\t%d\t%s\n' % (fname, family, term, page,
+                offset, section))
+            outputs[family].write(fname+'\x00'+term+'\n')
+            count += 1
+
+    for output in outputs.values():
+        output.close()
+
+    db.close()
+
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the terms in the extracted text")
+    parser.add_argument('--pages', type=int, default=3,
+        help="only search the first this many pages (default 3)")
+    parser.add_argument('--full', action='store_true',
+        help="search all the papers again, not just new or changed ones")
+    parser.add_argument('--no-corpus', action='store_true',
+        help="read the text from text.sqlite even if corpus.bin is up to date")
+    parser.add_argument('--processes', type=int, default=None,
+        help="processes to search the corpus with (default: number of cores)")
+    parser.add_argument('--check', action='store_true',
+        help="after updating, search everything again and check the results are the same")
+    parser.add_argument('--page-range', default=None, metavar='FIRST-LAST',
+        help="only output matches on these pages, e.g. 1-2 (default: all searched)")
+    parser.add_argument('--section', action='append', default=None, choices=sections,
+        help="only output matches in this section (may be repeated)")
+    metrics.addArguments(parser)
+    args = parser.parse_args()
+
+    pageRange = None
+    if args.page_range is not None:
+        try:
+            first, last = args.page_range.split('-', 1) if '-' in args.page_range \
+                else (args.page_range, args.page_range)
+            pageRange = (int(first), int(last))
+        except ValueError:
+            parser.error("--page-range should be like 1-2")
+
+        if pageRange[1] > args.pages:
+            parser.error("only the first %d pages are searched, see --pages" % args.pages)
+
+    metrics.configure(args.metrics, args.profile)
+
+    with metrics.stage('match') as stage:
+        stage.items = updateMatches('text.sqlite', 'matches.sqlite', args.pages,
+            full=args.full, corpusFile=None if args.no_corpus else 'corpus',
+            processes=args.processes)
+        print("Papers searched:", stage.items)
+
+    if args.check:
+        missing, extra = checkMatches('text.sqlite', 'matches.sqlite', args.pages,
+            corpusFile=None if args.no_corpus else 'corpus', processes=args.processes)
+
+        for row in missing:
+            print("Only when searching everything:", *row)
+        for row in extra:
+            print("Only in the saved matches:", *row)
+
+        if missing or extra:
+            sys.exit("Saved matches differ from searching everything, run with --full")
+        print("Same as searching everything")
+
+    with metrics.stage('export') as stage:
+        stage.items = exportMatches('matches.sqlite', 'grep', pageRange, args.section)
+        print("Matches:", stage.items)
+
+    metrics.save()
@@ -0,0 +1,283 @@
+"""
+Counters, latency histograms, and per-stage timing for long runs
+
+Each script records into the shared registry, e.g.
+
+    import metrics
+    metrics.inc('download_bytes_total', size, host=host)
+    metrics.observe('download_seconds', seconds, host=host)
+
+    with metrics.stage('extract') as s:
+        ...
+        s.items = len(files)
+
+A stage records its wall time, CPU time (including finished child processes,
+e.g. a Pool), memory, and the number of items processed. Memory is the
+resident set size (RSS) at the end of the stage and how much it grew during
+the stage (on Linux), and the peak RSS of the process so far, which is only
+the stage's own peak if it's the largest one yet. If the stage is
+one of those to profile, it's also run under cProfile and the profile saved to
+profile/<stage>.prof (view with python -m pstats). cProfile only sees the
+thread that started the stage, not worker threads or processes.
+
+Nothing is written unless an output file is configured. Output ending in .prom
+is written in the Prometheus text format (e.g. for the node exporter textfile
+collector), replacing the file, and anything else is appended to as JSON lines.
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import resource
+import threading
+
+# Upper bounds of the latency histogram buckets in seconds
+defaultBuckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+
+class Histogram:
+    """ Count of observations in each bucket along with their sum """
+    def __init__(self, buckets=defaultBuckets):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """ (upper bound, observations <= it), as Prometheus expects """
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+class Stage:
+    """ Set items to how many things the stage processed """
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+
+def cpuTime():
+    """ User and system time of this process and its finished children """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+def maxrssBytes(usage):
+    """ ru_maxrss of a resource usage in bytes """
+    scale = 1 if sys.platform == 'darwin' else 1024 # bytes on macOS, else KiB
+    return usage.ru_maxrss*scale
+
+def peakMemory():
+    """ Peak RSS in bytes of this process and of its largest finished child """
+    return max(maxrssBytes(resource.getrusage(who)) for who in
+        (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+def currentMemory():
+    """ Current RSS in bytes of this process, or None if unknown (not Linux) """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def labelKey(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+class Metrics:
+    """
+    Thread-safe registry of the metrics
+
+    output -- file to save to, or None to not save anything
+    profile -- names of the stages to profile, or 'all'
+    profiledir -- where to save the profiles
+    """
+    def __init__(self, output=None, profile=(), profiledir='profile'):
+        self.lock = threading.Lock()
+        self.configure(output, profile, profiledir)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def configure(self, output=None, profile=(), profiledir='profile'):
+        self.output = output
+        self.profile = set(profile)
+        self.profiledir = profiledir
+
+    def inc(self, name, value=1, **labels):
+        key = (name, labelKey(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, labelKey(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, labelKey(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def rates(self):
+        """ Bytes per second downloaded from each host """
+        with self.lock:
+            seconds = dict((labels, h.sum) for (name, labels), h
+                in self.histograms.items() if name == 'download_seconds')
+            return [(labels, value/seconds[labels]) for (name, labels), value
+                in self.counters.items() if name == 'download_bytes_total'
+                and seconds.get(labels)]
+
+    def save(self):
+        """ Write all the metrics to the output file if there is one """
+        if self.output is None:
+            return
+
+        for labels, rate in self.rates():
+            self.gauge('download_bytes_per_second', rate, **dict(labels))
+
+        directory = os.path.dirname(self.output)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with self.lock:
+            if self.output.endswith('.prom'):
+                self.savePrometheus(self.output)
+            else:
+                self.saveJSON(self.output)
+
+    def saveJSON(self, filename):
+        now = time.time()
+        script = os.path.basename(sys.argv[0])
+
+        with open(filename, 'a') as f:
+            for kind, items in (('counter', self.counters), ('gauge', self.gauges)):
+                for (name, labels), value in sorted(items.items()):
+                    f.write(json.dumps({'time': now, 'script': script, 'type': kind,
+                        'name': name, 'labels': dict(labels), 'value': value}) + '\n')
+
+            for (name, labels), h in sorted(self.histograms.items()):
+                f.write(json.dumps({'time': now, 'script': script,
+                    'type': 'histogram', 'name': name, 'labels': dict(labels),
+                    'count': h.count, 'sum': h.sum,
+                    'buckets': [[str(b), c] for b, c in h.cumulative()]}) + '\n')
+
+    def savePrometheus(self, filename):
+        lines = []
+
+        def fmt(name, labels, value):
+            if labels:
+                name += '{' + ','.join('%s="%s"' % (k, v.replace('\\', '\\\\')
+                    .replace('"', '\\"')) for k, v in labels) + '}'
+            return '%s %s' % (name, repr(float(value)))
+
+        for kind, items in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted(set(name for name, _ in items)):
+                lines.append('# TYPE %s %s' % (name, kind))
+                lines += [fmt(name, labels, value) for (n, labels), value
+                    in sorted(items.items()) if n == name]
+
+        for name in sorted(set(name for name, _ in self.histograms)):
+            lines.append('# TYPE %s histogram' % name)
+
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+
+                for bound, count in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(fmt(name+'_bucket', labels + (('le', le),), count))
+                lines.append(fmt(name+'_sum', labels, h.sum))
+                lines.append(fmt(name+'_count', labels, h.count))
+
+        # Replace at once so a collector never reads half a file
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, filename)
+
+class StageTimer:
+    """ Context manager recording the time and memory of a stage """
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.stage = Stage(name)
+        self.profiler = None
+
+    def __enter__(self):
+        name = self.stage.name
+
+        if name in self.metrics.profile or 'all' in self.metrics.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.cpu = cpuTime()
+        self.memory = currentMemory()
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = cpuTime() - self.cpu
+        name = self.stage.name
+
+        if self.profiler is not None:
+            self.profiler.disable()
+
+            if not os.path.exists(self.metrics.profiledir):
+                os.makedirs(self.metrics.profiledir)
+            self.profiler.dump_stats(os.path.join(self.metrics.profiledir, name+'.prof'))
+
+        self.metrics.gauge('stage_wall_seconds', wall, stage=name)
+        self.metrics.gauge('stage_cpu_seconds', cpu, stage=name)
+        self.metrics.gauge('process_peak_rss_bytes', peakMemory(), stage=name)
+
+        memory = currentMemory()
+        if memory is not None:
+            self.metrics.gauge('stage_rss_bytes', memory, stage=name)
+            self.metrics.gauge('stage_rss_growth_bytes', memory - self.memory, stage=name)
+
+        if self.stage.items is not None:
+            self.metrics.gauge('stage_items', self.stage.items, stage=name)
+
+        return False
+
+# Shared by all the scripts
+registry = Metrics()
+
+def configure(output=None, profile=(), profiledir='profile'):
+    """ Where to save the metrics and which stages to profile """
+    registry.configure(output, profile, profiledir)
+
+def addArguments(parser):
+    """ Add --metrics and --profile to a script's arguments """
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+        help="save timing and counts, as Prometheus text if FILE ends in .prom, "
+            "otherwise appended as JSON lines")
+    parser.add_argument('--profile', action='append', default=[], metavar='STAGE',
+        help="save a cProfile profile of this stage (or 'all') to profile/")
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def gauge(name, value, **labels):
+    registry.gauge(name, value, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def stage(name):
+    return registry.stage(name)
+
+def save():
+    registry.save()
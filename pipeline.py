@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Run all the steps, skipping those that are already up to date
+
+Each step is a stage with the stages it depends on and the files it reads and
+writes. Like make, a stage is skipped if all its outputs are newer than its
+inputs, and otherwise is run (as the same script you'd run by hand) once the
+stages it depends on are done. Stages that don't depend on each other, e.g.
+matching and building the word index, run at the same time.
+
+While downloading, the PDFs that finished downloading are extracted and
+searched as they arrive rather than waiting for all 25 GiB, so once the
+download is done only the last few are left. For example, to download,
+extract, match, and make the chart:
+
+    ./pipeline.py
+    ./pipeline.py --download-args="--concurrent --venue ICML"
+    ./pipeline.py index overlap
+"""
+import os
+import sys
+import time
+import shlex
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from manifest import Manifest
+from sources import parseFilename
+from verify_pdfs import unverified, checkFile
+from extract_text import extractAll
+from match_terms import updateMatches
+
+class Stage:
+    """
+    One step of the pipeline
+
+    name -- what to call it on the command line
+    command -- list of arguments to run it
+    deps -- names of stages that have to run first
+    inputs -- files or directories it reads
+    outputs -- files or directories it writes
+    due -- function returning whether there's work left even if the outputs
+        are newer than the inputs, e.g. downloads to retry
+    """
+    def __init__(self, name, command, deps=(), inputs=(), outputs=(), due=None):
+        self.name = name
+        self.command = command
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.due = due
+
+    def upToDate(self):
+        """
+        Whether all the outputs exist and are newer than all the inputs, and
+        there's nothing due. A stage without outputs is up to date whenever
+        nothing is due.
+        """
+        if self.due is not None and self.due():
+            return False
+
+        if not self.outputs and self.due is not None:
+            return True
+
+        outputs = [mtime(f) for f in self.outputs]
+
+        if not outputs or None in outputs:
+            return False
+
+        inputs = [t for t in (mtime(f) for f in self.inputs) if t is not None]
+
+        return not inputs or max(inputs) <= min(outputs)
+
+    def run(self):
+        """ Returns whether it succeeded """
+        return subprocess.run(self.command).returncode == 0
+
+def mtime(path):
+    """
+    Last modification time of a file or directory (so when files were added
+    or removed), or None if it doesn't exist. For SQLite databases, writes
+    may only be in the write-ahead log, so that counts too.
+    """
+    times = [os.stat(p).st_mtime_ns for p in (path, path+'-wal')
+        if os.path.exists(p)]
+    return max(times) if times else None
+
+def downloadsDue(manifestFile='manifest.sqlite', venues=None):
+    """
+    Whether there are downloads to do now, e.g. failures whose backoff is
+    over or files verify_pdfs.py found were bad, only counting those of the
+    venues download_pdfs.py is run for, if given, since it skips the others
+    """
+    if not os.path.exists(manifestFile):
+        return False
+
+    manifest = Manifest(manifestFile)
+    pending = manifest.pending()
+    manifest.close()
+
+    if venues is not None:
+        venues = set(v.upper() for v in venues)
+        pending = [(url, fname) for url, fname in pending
+            if (parseFilename(fname)[0] or '').upper() in venues]
+
+    return len(pending) > 0
+
+def downloadVenues(downloadArgs):
+    """ The --venue options of download_pdfs.py, or None if all of them """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--venue', action='append', default=None)
+    return parser.parse_known_args(downloadArgs)[0].venue
+
+def verifyDue(pdfdir='pdfs', manifestFile='manifest.sqlite'):
+    """ Whether there are PDFs not verified since they last changed """
+    verified = {}
+
+    if os.path.exists(manifestFile):
+        manifest = Manifest(manifestFile)
+        verified = manifest.verified()
+        manifest.close()
+
+    return len(unverified(pdfdir, verified)) > 0
+
+def script(name, *args):
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        name)] + list(args)
+
+def getStages(pages=3, downloadArgs=()):
+    """ All the stages by name """
+    pages = ['--pages', str(pages)]
+    venues = downloadVenues(downloadArgs)
+
+    stages = [
+        # When the venues change since new papers can't be known otherwise, or
+        # to retry failed downloads once their backoff is over
+        Stage('download', script('download_pdfs.py', *downloadArgs),
+            inputs=['sources.py'], outputs=['manifest.sqlite'],
+            due=lambda: downloadsDue(venues=venues)),
+        # When there are new or changed files, which the manifest records
+        # rather than an output file, and downloading may not change the
+        # time of pdfs/ (e.g. resumed files)
+        Stage('verify', script('verify_pdfs.py'), deps=['download'],
+            inputs=['pdfs', 'verify_pdfs.py'], due=verifyDue),
+        Stage('extract', script('extract_text.py', *pages), deps=['verify'],
+            inputs=['pdfs', 'extract_text.py'], outputs=['text.sqlite']),
+        Stage('corpus', script('corpus_store.py', *pages), deps=['extract'],
+            inputs=['text.sqlite', 'corpus_store.py'],
+            outputs=['corpus.bin', 'corpus.idx', 'corpus.json']),
+        Stage('match', script('match_terms.py', *pages), deps=['corpus'],
+            inputs=['text.sqlite', 'corpus.json', 'match_terms.py'],
+            outputs=['matches.sqlite', 'grep/matches.tsv']),
+        Stage('index', script('term_index.py', '--build', *pages), deps=['extract'],
+            inputs=['text.sqlite', 'term_index.py'], outputs=['index.sqlite']),
+        Stage('chart', script('generate_chart.py', '--plot'), deps=['match'],
+            inputs=['grep/matches.tsv', 'generate_chart.py'],
+            outputs=['bar.png', 'list/overlap.txt', 'list/cube.csv']),
+        Stage('overlap', ['bash', os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), 'just_overlap.sh')], deps=['chart'],
+            inputs=['list/overlap.txt'], outputs=['pdfs_just_overlap']),
+    ]
+
+    return dict((stage.name, stage) for stage in stages)
+
+def required(targets, stages):
+    """ Names of the targets and all the stages they depend on """
+    needed = set()
+    todo = list(targets)
+
+    while todo:
+        name = todo.pop()
+
+        if name not in needed:
+            needed.add(name)
+            todo += stages[name].deps
+
+    return needed
+
+class Follower(threading.Thread):
+    """
+    Extract and search the PDFs that finished downloading while the download
+    is still running. Since verify only runs after the download, files are
+    first checked to look like PDFs (see verify_pdfs.checkFile, without
+    parsing them) so error pages and truncated files aren't extracted. Those
+    are left for verify to requeue.
+    """
+    def __init__(self, pages=3, processes=None, interval=10,
+            manifestFile='manifest.sqlite', match=True):
+        super().__init__(daemon=True)
+        self.pages = pages
+        self.processes = processes
+        self.interval = interval
+        self.manifestFile = manifestFile
+        self.match = match
+        self.done = threading.Event()
+        self.since = 0
+        self.count = 0
+
+    def stop(self):
+        """ Process what's left and wait for it to finish """
+        self.done.set()
+        self.join()
+
+    def step(self):
+        manifest = Manifest(self.manifestFile)
+        rows = manifest.completedSince(self.since)
+        manifest.close()
+
+        if not rows:
+            return
+
+        self.since = rows[-1][1]
+
+        # Duplicates were deleted after downloading
+        files = []
+        for fname, _ in rows:
+            if os.path.exists(fname):
+                stat = os.stat(fname)
+                problem = checkFile((fname, stat.st_size, stat.st_mtime_ns, None, None))[3]
+
+                if problem is None:
+                    files.append(fname)
+
+        if files:
+            total, extracted = extractAll('pdfs', 'text.sqlite', self.pages,
+                self.processes, filenames=files, progress=False)
+            self.count += extracted
+
+            if extracted and self.match:
+                updateMatches('text.sqlite', 'matches.sqlite', self.pages)
+
+    def run(self):
+        while True:
+            finished = self.done.wait(self.interval)
+            self.step()
+
+            if finished:
+                break
+
+def runPipeline(targets, stages, force=(), dryRun=False, stream=True, pages=3,
+        processes=None):
+    """
+    Run the targets and the stages they depend on that aren't up to date,
+    running independent stages at the same time. Returns whether all
+    succeeded.
+    """
+    needed = required(targets, stages)
+    force = needed if 'all' in force else set(force)
+    finished = set()
+    failed = set()
+    ran = set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=len(needed)) as executor:
+        while True:
+            # Start all those whose dependencies are done
+            started = False
+
+            for name in sorted(needed - finished - failed - set(running.values())):
+                stage = stages[name]
+
+                if any(d in failed for d in stage.deps):
+                    print("Skipping", name, "since", ", ".join(
+                        d for d in stage.deps if d in failed), "failed")
+                    failed.add(name)
+                    started = True
+                    continue
+
+                if not all(d in finished for d in stage.deps):
+                    continue
+
+                started = True
+
+                # When not actually running, the inputs wouldn't be updated
+                if name not in force and stage.upToDate() and \
+                        not (dryRun and any(d in ran for d in stage.deps)):
+                    print("Up to date:", name)
+                    finished.add(name)
+                    continue
+
+                print("Running", name + ":", " ".join(map(shlex.quote, stage.command)))
+                ran.add(name)
+
+                if dryRun:
+                    finished.add(name)
+                    continue
+
+                follower = None
+                if name == 'download' and stream and 'extract' in needed:
+                    follower = Follower(pages, processes, match='match' in needed)
+                    follower.start()
+
+                # Bad files verify_pdfs.py requeued are downloaded again now
+                redownload = stages.get('download') if name == 'verify' else None
+
+                running[executor.submit(runStage, stage, follower, redownload)] = name
+
+            if not running:
+                if started:
+                    continue
+                break
+
+            # Wait for one to finish since that may let others start
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+
+                if future.result():
+                    finished.add(name)
+                else:
+                    print("Failed:", name)
+                    failed.add(name)
+
+    return not failed
+
+def runStage(stage, follower=None, redownload=None):
+    start = time.time()
+    success = stage.run()
+
+    if follower is not None:
+        follower.stop()
+        print("Extracted while downloading:", follower.count)
+
+    # Only once, so a URL that keeps returning an error page can't loop
+    if success and redownload is not None and redownload.due():
+        print("Running", redownload.name, "again for the files", stage.name, "requeued")
+        success = redownload.run() and stage.run()
+
+    print("Finished" if success else "Failed", stage.name,
+        "in %.1f s" % (time.time() - start))
+
+    return success
+
+if __name__ == '__main__':
+    stages = getStages()
+
+    parser = argparse.ArgumentParser(description="Download, extract, match, and make the chart, skipping what's up to date")
+    parser.add_argument('targets', nargs='*', default=['chart'], metavar='STAGE',
+        help="stages to run along with those they depend on, any of: "
+            + ", ".join(stages.keys()) + " (default chart)")
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+        help="run this stage even if it's up to date, or 'all' (may be repeated)")
+    parser.add_argument('--dry-run', action='store_true',
+        help="only print which stages would run")
+    parser.add_argument('--no-stream', action='store_true',
+        help="don't extract the PDFs until they're all downloaded")
+    parser.add_argument('--pages', type=int, default=3,
+        help="pages to extract and search (default 3)")
+    parser.add_argument('--processes', type=int, default=None,
+        help="PDFs to extract at once while downloading (default: number of cores)")
+    parser.add_argument('--download-args', default='',
+        help="options for download_pdfs.py, e.g. \"--concurrent --venue ICML\"")
+    args = parser.parse_args()
+
+    for name in args.targets + args.force:
+        if name != 'all' and name not in stages:
+            parser.error("unknown stage " + name)
+
+    stages = getStages(args.pages, shlex.split(args.download_args))
+
+    if not runPipeline(args.targets, stages, args.force, args.dry_run,
+            not args.no_stream, args.pages, args.processes):
+        sys.exit(1)
@@ -0,0 +1,363 @@
+"""
+Where to find the papers for each conference and journal
+
+Each source lists its index page for each year, the XPath to find the links on
+those pages, a regex of which links are papers, and how to turn a link into
+the PDF URL. To add a venue or year, add it to the registry at the bottom.
+
+OpenReview and arXiv are read through their APIs rather than pages of links:
+all the pages of OpenReview results (offset and limit) are fetched at once
+after the first says how many there are, and arXiv papers are looked up up to
+100 at a time with id_list. Any base URL can be pointed elsewhere with
+setBaseURL(), e.g. at fixtures/server.py to try them without the network.
+"""
+import os
+import re
+import json
+import lxml.etree
+from urllib.parse import urlparse, urljoin, urlencode, parse_qs
+
+def get_filename(s):
+    """ https://stackoverflow.com/a/18727481/2698494 """
+    return os.path.basename(urlparse(s).path)
+
+# Replacement base URLs, e.g. {'https://openreview.net': 'http://localhost:8000'}
+baseURLs = {}
+
+def setBaseURL(original, replacement):
+    """ Fetch URLs starting with original from replacement instead """
+    baseURLs[original.rstrip('/')] = replacement.rstrip('/')
+
+def rebase(url):
+    """ The URL to fetch after any setBaseURL() """
+    for original, replacement in baseURLs.items():
+        if url == original or url.startswith(original + '/') \
+                or url.startswith(original + '?'):
+            return replacement + url[len(original):]
+
+    return url
+
+def parseFilename(filename):
+    """
+    Get the venue and year from the prefix of a filename we saved, e.g.
+    pdfs/ICML_2015_xyz.pdf is (ICML, 2015). Returns (None, None) if there's no
+    such prefix.
+    """
+    parts = os.path.basename(filename).split('_', 2)
+
+    if len(parts) == 3 and parts[1].isdigit():
+        return parts[0], int(parts[1])
+
+    return None, None
+
+class Source:
+    """
+    Papers linked from an index page
+
+    name -- venue, used in the filename prefix, e.g. ICML_2015_
+    urls -- {year: index page URL}
+    search -- XPath of the links on the index page
+    include -- regex a link must contain to be a paper
+    exclude -- regex a link must not contain (e.g. supplementary material)
+    rewrite -- (pattern, replacement) substitution to get the download URL
+    urlSuffix -- append to the URL, e.g. NIPS links don't end in .pdf
+    fnameSuffix -- append to the filename, e.g. AAAI URLs don't end in .pdf
+    follow -- regex of links on the index page to pages that have the PDF
+        links, e.g. to arXiv abstract pages. The include, exclude, etc. options
+        then apply to the links on those pages.
+    """
+    raw = False
+
+    def __init__(self, name, urls, search='//a/@href', include=None,
+            exclude=None, rewrite=None, urlSuffix='', fnameSuffix='',
+            follow=None):
+        self.name = name
+        self.urls = urls
+        self.search = search
+        self.rewrite = rewrite
+        self.urlSuffix = urlSuffix
+        self.fnameSuffix = fnameSuffix
+        self.follow = re.compile(follow) if follow is not None else None
+
+        # Single regex for both, links often have newlines in them
+        regex = '(?s)^'
+        if exclude is not None:
+            regex += '(?!.*(?:' + exclude + '))'
+        if include is not None:
+            regex += '(?=.*(?:' + include + '))'
+        self.match = re.compile(regex).match
+
+        if rewrite is not None:
+            self.rewritePattern = re.compile(rewrite[0])
+
+    def prefix(self, year):
+        return self.name + "_" + str(year) + "_"
+
+    def indexURL(self, year):
+        """ First page to fetch for the year """
+        return rebase(self.urls[year])
+
+    def pages(self, links):
+        """ Links on the index page that need to be followed """
+        if self.follow is None:
+            return []
+
+        return [link for link in links if self.follow.search(link)]
+
+    def expand(self, year, url, links, data=None):
+        """
+        (papers, more URLs to fetch for the year) from a fetched page. The
+        papers come from the followed pages if following links, otherwise
+        from the index page.
+        """
+        if self.follow is not None and url == self.indexURL(year):
+            return [], self.pages(links)
+
+        return self.papers(year, url, links, data), []
+
+    def papers(self, year, url, links, data=None):
+        """
+        List of (PDF URL, filename) from the links on the page url, either the
+        index page or, if following links, one of the followed pages
+        """
+        papers = []
+
+        for link in links:
+            if self.match(link):
+                link = link.strip() # some links have newlines at the end
+
+                if self.rewrite is not None:
+                    link = self.rewritePattern.sub(self.rewrite[1], link)
+
+                abspath = urljoin(url.strip(), link) + self.urlSuffix # some links are relative
+                fname = self.prefix(year) + get_filename(abspath) + self.fnameSuffix
+                papers.append((abspath, fname))
+
+        return papers
+
+class OpenReviewSource(Source):
+    """
+    Accepted papers from the OpenReview notes API, which returns JSON rather
+    than a page of links
+
+    urls -- {year: invitation of the decisions}
+    limit -- notes to ask for per request, the most the API allows
+    """
+    raw = True
+
+    def __init__(self, name, urls, decision='Accept', limit=1000,
+            api='https://openreview.net'):
+        super().__init__(name, urls)
+        self.decision = decision
+        self.limit = limit
+        self.api = api
+
+    def pageURL(self, year, offset):
+        return rebase(self.api + '/notes?' + urlencode([('invitation', self.urls[year]),
+            ('offset', offset), ('limit', self.limit)]))
+
+    def indexURL(self, year):
+        return self.pageURL(year, 0)
+
+    def expand(self, year, url, links, data=None):
+        """
+        The first page says how many notes there are, so all the other pages
+        can then be fetched at once. Since the server may return fewer than
+        the limit per page, the pages are as long as the first one.
+        """
+        j = json.loads(data.decode('utf-8'))
+        papers = self.papers(year, url, links, data, j)
+        offset = int(parse_qs(urlparse(url).query).get('offset', ['0'])[0])
+        size = len(j["notes"])
+
+        if size == 0:
+            return papers, []
+
+        if "count" in j:
+            if offset > 0:
+                return papers, []
+            more = range(size, j["count"], size)
+        else:
+            # Without a count, keep going until a page is empty since the
+            # server may return fewer than asked for even if there are more
+            more = [offset + size]
+
+        return papers, [self.pageURL(year, o) for o in more]
+
+    def papers(self, year, url, links, data=None, j=None):
+        if j is None:
+            j = json.loads(data.decode('utf-8'))
+        papers = []
+
+        for entry in j["notes"]:
+            if self.decision in entry["content"]["decision"]:
+                # Looks like replyto and forum link to the ID of the actual PDF
+                papers.append((rebase(self.api + "/pdf?id=" + entry["replyto"]),
+                    self.prefix(year)+entry["replyto"]+".pdf"))
+
+        return papers
+
+class ArXivSource(Source):
+    """
+    Papers on arXiv linked from an index page, looked up in batches with the
+    arXiv API rather than fetching each abstract page
+
+    Note: this doesn't download it if the latest arXiv version doesn't
+    provide a PDF
+    """
+    raw = True
+
+    # New (1412.6980) and old (cs/0112017) style IDs, without the version so
+    # the latest is looked up
+    idRegex = re.compile(r'arxiv\.org/(?:abs|pdf)/(\d{4}\.\d{4,5}|[a-z-]+(?:\.[A-Z]{2})?/\d{7})')
+    atom = '{http://www.w3.org/2005/Atom}'
+
+    def __init__(self, name, urls, batch=100, api='http://export.arxiv.org'):
+        super().__init__(name, urls, fnameSuffix='.pdf')
+        self.batch = batch
+        self.api = api
+
+    def pages(self, links):
+        """ API queries for all the arXiv papers linked to """
+        ids = []
+
+        for link in links:
+            m = self.idRegex.search(link)
+            if m is not None and m.group(1) not in ids:
+                ids.append(m.group(1))
+
+        return [rebase(self.api + '/api/query?' + urlencode([('id_list',
+            ','.join(ids[i:i+self.batch])), ('max_results', self.batch)]))
+            for i in range(0, len(ids), self.batch)]
+
+    def expand(self, year, url, links, data=None):
+        if url == self.indexURL(year):
+            return [], self.pages(links)
+
+        return self.papers(year, url, links, data), []
+
+    def papers(self, year, url, links, data=None):
+        feed = lxml.etree.fromstring(data)
+        papers = []
+
+        for entry in feed.iter(self.atom + 'entry'):
+            for link in entry.iter(self.atom + 'link'):
+                if link.get('title') == 'pdf':
+                    # Same URL as the PDF link on the abstract page
+                    pdf = re.sub(r'^https?://arxiv\.org/', 'https://arxiv.org/',
+                        link.get('href'))
+                    papers.append((rebase(pdf),
+                        self.prefix(year) + get_filename(pdf) + self.fnameSuffix))
+
+        return papers
+
+# Conferences with links to .pdf on their webpages, but only download PDFs that
+# are not supplementary material
+#
+# -supp -- PMLR supplementary material
+# supplemental/ -- CVPR supplemental material
+# AbsBook -- CVPR extracted abstracts from PDFs
+# poster/ -- CVPR posters
+# erratum. -- IJCAI erratum for papers
+# frontmatter -- IJCAI front matter
+# appendix -- JMLR appendices
+# attachments/ -- ACL has some datasets, notes, presentations, etc. files
+notSupplementary = r'-supp|supplemental/|AbsBook|poster/|erratum\.|frontmatter|appendix|attachments/'
+
+sources = [
+    Source('ICML', {
+        2014: 'http://proceedings.mlr.press/v32/',
+        2015: 'http://proceedings.mlr.press/v37/',
+        2016: 'http://proceedings.mlr.press/v48/',
+        2017: 'http://proceedings.mlr.press/v70/',
+        2018: 'http://proceedings.mlr.press/v80/'
+    }, include=r'\.pdf', exclude=notSupplementary),
+    Source('AISTATS', {
+        2014: 'http://proceedings.mlr.press/v33/',
+        2015: 'http://proceedings.mlr.press/v38/',
+        2016: 'http://proceedings.mlr.press/v51/',
+        2017: 'http://proceedings.mlr.press/v54/',
+        2018: 'http://proceedings.mlr.press/v84/'
+    }, include=r'\.pdf', exclude=notSupplementary),
+    Source('ACL', {
+        2014: 'http://www.aclweb.org/anthology/P/P14/',
+        2015: 'http://www.aclweb.org/anthology/P/P15/',
+        2016: 'http://www.aclweb.org/anthology/P/P16/',
+        2017: 'http://www.aclweb.org/anthology/P/P17/'
+    }, include=r'\.pdf', exclude=notSupplementary),
+    Source('CVPR', {
+        2014: 'http://openaccess.thecvf.com/CVPR2014.py',
+        2015: 'http://openaccess.thecvf.com/CVPR2015.py',
+        2016: 'http://openaccess.thecvf.com/CVPR2016.py',
+        2017: 'http://openaccess.thecvf.com/CVPR2017.py',
+        2018: 'http://openaccess.thecvf.com/CVPR2018.py'
+    }, include=r'\.pdf', exclude=notSupplementary),
+    Source('IJCAI', {
+        2015: 'https://www.ijcai.org/proceedings/2015/',
+        2016: 'https://www.ijcai.org/proceedings/2016/',
+        2017: 'https://www.ijcai.org/proceedings/2017/',
+        2018: 'https://www.ijcai.org/proceedings/2018/'
+    }, include=r'\.pdf', exclude=notSupplementary),
+    Source('JMLR', {
+        2014: 'http://www.jmlr.org/papers/v15/',
+        2015: 'http://www.jmlr.org/papers/v16/',
+        2016: 'http://www.jmlr.org/papers/v17/',
+        2017: 'http://www.jmlr.org/papers/v18/' # and 2018
+    }, include=r'\.pdf', exclude=notSupplementary),
+
+    # Grab the URLs and add .pdf (NIPS links are relative)
+    Source('NIPS', {
+        2014: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-27-2014',
+        2015: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-28-2015',
+        2016: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-29-2016',
+        2017: 'https://papers.nips.cc/book/advances-in-neural-information-processing-systems-30-2017'
+    }, include=r'/paper', urlSuffix='.pdf'),
+
+    # These take more work
+    #
+    # ICLR 2015-2016 point to arXiv, so download the PDF on arXiv
+    ArXivSource('ICLR', {
+        2015: 'https://iclr.cc/archive/www/doku.php%3Fid=iclr2015:accepted-main.html',
+        2016: 'https://iclr.cc/archive/www/doku.php%3Fid=iclr2016:accepted-main.html',
+    }),
+    #2017: 'https://openreview.net/group?id=ICLR.cc/2017/conference',
+    #2018: 'https://openreview.net/group?id=ICLR.cc/2018/Conference',
+    OpenReviewSource('ICLR', {
+        2017: 'ICLR.cc/2017/conference/-/paper.*/acceptance',
+        2018: 'ICLR.cc/2018/conference/-/paper.*/acceptance',
+    }),
+    # For AAAI papers, make a substitution in the link to get download URL
+    Source('AAAI', {
+        2014: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI14/schedConf/presentations',
+        2015: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI15/schedConf/presentations',
+        2016: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI16/schedConf/presentations',
+        2017: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI17/schedConf/presentations',
+        2018: 'https://www.aaai.org/ocs/index.php/AAAI/AAAI18/schedConf/presentations'
+    }, search="//a[contains(@class, 'file')]/@href", include=r'paper/view',
+        rewrite=(r'paper/view', 'paper/download'), fnameSuffix='.pdf'),
+
+    # Not worth it -- ACM requires downloading immediately to not get forbidden
+    # and doesn't look like there's GAN papers. The PDF link is in Javascript
+    # code: window.location.replace('...') and you get a different page
+    # without a referer.
+    #'KDD': {
+    #    2015: 'http://www.kdd.org/kdd2015/toc.html',
+    #    2016: 'http://www.kdd.org/kdd2016/program/accepted-papers',
+    #    2017: 'http://www.kdd.org/kdd2017/accepted-papers'
+    #},
+    # Springer ones would be difficult
+    #'ECCV': {
+    #    2014: 'http://eccv2014.org/proceedings/',
+    #    2016: 'http://www.eccv2016.org/proceedings/'
+    #},
+    #International Journal of Computer Vision (IJCV)
+    #Machine Learning (Springer) https://link.springer.com/journal/10994
+]
+
+def getSources(names=None):
+    """ All sources, or only those for the given venue names """
+    if names is None:
+        return sources
+
+    names = set(n.upper() for n in names)
+    return [s for s in sources if s.name.upper() in names]
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Inverted index of the words in the extracted text for ad-hoc queries
+
+Rather than searching all the PDFs again to try a new term, build an index
+once from text.sqlite of which papers contain each word. Queries can then use
+AND, OR, NOT, and parentheses, e.g.
+
+    ./term_index.py --build
+    ./term_index.py "GAN AND (domain adaptation OR multi-task)"
+
+A word ending in * matches all words starting with it, e.g. GAN* also finds
+GANs. Multiple words are a phrase. The index also has where in each paper
+each word is, so phrases are found from the index alone without reading the
+text of any of the papers.
+"""
+import re
+import sys
+import bisect
+import sqlite3
+import argparse
+from array import array
+
+from sources import parseFilename
+from extract_text import TextStore
+
+schema = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT UNIQUE NOT NULL,
+    venue TEXT,
+    year INTEGER
+);
+CREATE TABLE IF NOT EXISTS postings (
+    word TEXT PRIMARY KEY,
+    docs BLOB NOT NULL, -- sorted array of 32-bit doc ids
+    offsets BLOB NOT NULL, -- where each doc's positions start, then the end
+    positions BLOB NOT NULL -- 32-bit word numbers in each doc, in order
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+wordRegex = re.compile(r'\w+')
+
+def words(text):
+    return wordRegex.findall(text.lower())
+
+class Posting:
+    """ Docs containing a word and where in each of them it is """
+    def __init__(self):
+        self.docs = array('I')
+        self.offsets = array('I', [0])
+        self.positions = array('I')
+
+    def add(self, doc, positions):
+        self.docs.append(doc)
+        self.positions.extend(positions)
+        self.offsets.append(len(self.positions))
+
+def buildIndex(storeFile='text.sqlite', indexFile='index.sqlite', pages=3):
+    """ Index the words and their positions in the first pages of each paper """
+    store = TextStore(storeFile)
+    postings = {}
+    docs = []
+
+    for i, (fname, _, text) in enumerate(store.items()):
+        venue, year = parseFilename(fname)
+        docs.append((i, fname, venue, year))
+        positions = {}
+
+        for position, word in enumerate(words(' '.join(text[:pages]))):
+            positions.setdefault(word, []).append(position)
+
+        for word, ps in positions.items():
+            if word not in postings:
+                postings[word] = Posting()
+            postings[word].add(i, ps)
+
+    store.close()
+
+    db = sqlite3.connect(indexFile)
+    # Indexes from before positions were saved have fewer columns
+    db.execute("DROP TABLE IF EXISTS postings")
+    db.executescript(schema)
+
+    with db:
+        db.execute("DELETE FROM docs")
+        db.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", docs)
+        db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)",
+            ((word, p.docs.tobytes(), p.offsets.tobytes(), p.positions.tobytes())
+                for word, p in postings.items()))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('pages', ?)", (str(pages),))
+
+    db.close()
+
+    return len(docs), len(postings)
+
+def tokenize(query):
+    return re.findall(r'"[^"]*"|\(|\)|[^\s()"]+', query)
+
+class TermIndex:
+    """ Query the index built with buildIndex() """
+    def __init__(self, indexFile='index.sqlite'):
+        self.db = sqlite3.connect(indexFile)
+
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(postings)")]
+        if 'positions' not in columns:
+            self.db.close()
+            raise ValueError("Index is from an older version, rebuild it with --build")
+
+        self.pages = int(self.db.execute(
+            "SELECT value FROM meta WHERE key = 'pages'").fetchone()[0])
+        self.docs = dict((i, (fname, venue, year)) for i, fname, venue, year in
+            self.db.execute("SELECT id, filename, venue, year FROM docs"))
+
+    def word(self, word):
+        """ Set of doc ids containing the word """
+        row = self.db.execute("SELECT docs FROM postings WHERE word = ?",
+            (word,)).fetchone()
+
+        if row is None:
+            return set()
+
+        ids = array('I')
+        ids.frombytes(row[0])
+        return set(ids)
+
+    def prefix(self, prefix):
+        """ Set of doc ids containing a word starting with prefix """
+        prefix = prefix.lower()
+        found = set()
+
+        for row, in self.db.execute("""SELECT docs FROM postings
+                WHERE word >= ? AND word < ?""", (prefix, prefix + '\U0010ffff')):
+            ids = array('I')
+            ids.frombytes(row)
+            found.update(ids)
+
+        return found
+
+    def positions(self, word, docs):
+        """ Dictionary from each of the docs to the positions of the word in it """
+        row = self.db.execute("""SELECT docs, offsets, positions FROM postings
+            WHERE word = ?""", (word,)).fetchone()
+        ids, offsets, positions = array('I'), array('I'), array('I')
+
+        if row is not None:
+            ids.frombytes(row[0])
+            offsets.frombytes(row[1])
+            positions.frombytes(row[2])
+
+        # Doc ids are sorted, so find each one's positions by bisection
+        found = {}
+        for doc in docs:
+            j = bisect.bisect_left(ids, doc)
+            if j < len(ids) and ids[j] == doc:
+                found[doc] = positions[offsets[j]:offsets[j+1]]
+
+        return found
+
+    def phrase(self, phrase):
+        """
+        Set of doc ids containing the words one after another (separated by
+        spaces, hyphens, etc.)
+        """
+        ws = words(phrase)
+
+        if len(ws) == 1 and phrase.strip().endswith('*'):
+            return self.prefix(ws[0])
+
+        if not ws:
+            return set()
+
+        candidates = self.word(ws[0])
+        for w in ws[1:]:
+            candidates &= self.word(w)
+
+        if len(ws) == 1:
+            return candidates
+
+        # Where the phrase could start in each doc, i.e. the position of the
+        # first word where the k-th word is k words later
+        starts = dict((i, set(ps)) for i, ps in
+            self.positions(ws[0], candidates).items())
+
+        for k, w in enumerate(ws[1:], 1):
+            for i, ps in self.positions(w, list(starts)).items():
+                starts[i] &= set(p - k for p in ps)
+                if not starts[i]:
+                    del starts[i]
+
+        found = set(starts)
+
+        # Also when written as one word, e.g. multitask for multi-task
+        return found | self.word(''.join(ws))
+
+    def query(self, query):
+        """ List of (filename, venue, year) of the papers matching the query """
+        self.tokens = tokenize(query)
+        self.pos = 0
+        result = self.parseOr()
+
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected " + self.tokens[self.pos] + " in query")
+
+        return sorted(self.docs[i] for i in result)
+
+    # Recursive descent, where NOT binds tightest then AND then OR
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parseOr(self):
+        result = self.parseAnd()
+
+        while self.peek() == 'OR':
+            self.pos += 1
+            result = result | self.parseAnd()
+
+        return result
+
+    def parseAnd(self):
+        result = self.parseNot()
+
+        while self.peek() == 'AND':
+            self.pos += 1
+            result = result & self.parseNot()
+
+        return result
+
+    def parseNot(self):
+        if self.peek() == 'NOT':
+            self.pos += 1
+            return set(self.docs.keys()) - self.parseNot()
+
+        if self.peek() == '(':
+            self.pos += 1
+            result = self.parseOr()
+
+            if self.peek() != ')':
+                raise ValueError("Missing ) in query")
+
+            self.pos += 1
+            return result
+
+        # Quoted phrase or words until the next operator
+        token = self.peek()
+
+        if token is None or token in ('AND', 'OR', ')'):
+            raise ValueError("Expected a term in query")
+
+        if token.startswith('"'):
+            self.pos += 1
+            return self.phrase(token.strip('"'))
+
+        phrase = []
+        while self.peek() is not None and self.peek() not in ('AND', 'OR', 'NOT', '(', ')') \
+                and not self.peek().startswith('"'):
+            phrase.append(self.peek())
+            self.pos += 1
+
+        return self.phrase(' '.join(phrase))
+
+    def close(self):
+        self.db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the papers, e.g. \"GAN AND (domain adaptation OR multi-task)\"")
+    parser.add_argument('query', nargs='?', default=None,
+        help="terms combined with AND, OR, NOT, and parentheses")
+    parser.add_argument('--build', action='store_true',
+        help="(re)build the index from text.sqlite")
+    parser.add_argument('--pages', type=int, default=3,
+        help="when building, index the first this many pages (default 3)")
+    args = parser.parse_args()
+
+    if args.build:
+        papers, numWords = buildIndex('text.sqlite', 'index.sqlite', args.pages)
+        print("Papers:", papers, "Words:", numWords, file=sys.stderr)
+
+    if args.query is not None:
+        try:
+            index = TermIndex('index.sqlite')
+        except ValueError as e:
+            parser.error(str(e))
+
+        try:
+            results = index.query(args.query)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            index.close()
+
+        for fname, venue, year in results:
+            print(fname, venue or '', year or '', sep='\t')
+
+        print("Papers:", len(results), file=sys.stderr)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Check that the downloaded files are really PDFs
+
+Some sites return an HTML error page or captcha with a 200 status, and some
+downloads are cut short, which then quietly match nothing. Each file in pdfs/
+is checked in parallel that it:
+
+    starts with %PDF- (HTML pages are reported as such)
+    ends with %%EOF, so it isn't truncated
+    is the size it was when downloaded, which was checked against the
+        Content-Length
+    can be opened by the PDF library text is extracted with (unless
+        --no-parse, or none is installed)
+
+Files that fail are moved to quarantine/ and their URLs downloaded again the
+next time download_pdfs.py runs. pipeline.py does this right after verifying,
+and runs the download whenever the manifest has downloads due. Files that
+passed are recorded in the manifest with their size and modification time, so
+only new or changed files are checked on later runs.
+
+    ./verify_pdfs.py
+"""
+import os
+import shutil
+import argparse
+import subprocess
+from multiprocessing import Pool
+from tqdm import tqdm # progress bar
+
+import metrics
+from manifest import Manifest
+from extract_text import getBackend
+
+# Increment when changing the checks so all the files are checked again
+verifyVersion = 1
+
+# Bytes at the start and end of the file to look for the header and trailer
+# in, since some PDFs have junk before %PDF- or after %%EOF
+headerBytes = 1024
+trailerBytes = 2048
+
+def parseable(filename, backend):
+    """ Whether the PDF library can read the first page """
+    try:
+        if backend == 'pymupdf':
+            import fitz
+
+            with fitz.open(filename) as doc:
+                return len(doc) > 0 and doc[0] is not None
+        elif backend == 'pdfminer':
+            from pdfminer.pdfparser import PDFParser
+            from pdfminer.pdfdocument import PDFDocument
+            from pdfminer.pdfpage import PDFPage
+
+            with open(filename, 'rb') as f:
+                doc = PDFDocument(PDFParser(f))
+                return next(PDFPage.create_pages(doc), None) is not None
+        else:
+            return subprocess.run(['pdfinfo', filename], stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL).returncode == 0
+    except Exception:
+        # The parsers raise all sorts of things on broken files
+        return False
+
+def parseBackend():
+    """
+    Which library to check the PDFs can be read with, or None (with a
+    warning) if there's none, so that valid PDFs aren't all reported as
+    unparseable when a tool is missing
+    """
+    backend = getBackend()
+
+    if backend == 'pdftotext' and shutil.which('pdfinfo') is None:
+        backend = None
+
+    if backend is None:
+        print("Warning: none of PyMuPDF, pdfminer.six, or pdfinfo (poppler-utils) "
+            "are installed, not checking that the PDFs can be read")
+
+    return backend
+
+def checkFile(args):
+    """ (filename, size, mtime, problem or None) """
+    filename, size, mtime, expected, backend = args
+
+    if size == 0:
+        return filename, size, mtime, 'empty'
+
+    with open(filename, 'rb') as f:
+        head = f.read(headerBytes)
+        f.seek(max(0, size - trailerBytes))
+        tail = f.read()
+
+    if b'%PDF-' not in head:
+        start = head.lstrip().lower()
+        html = start.startswith(b'<!doctype html') or start.startswith(b'<html')
+        return filename, size, mtime, 'html' if html else 'not a PDF'
+
+    if b'%%EOF' not in tail:
+        return filename, size, mtime, 'truncated'
+
+    if expected is not None and size != expected:
+        return filename, size, mtime, 'size'
+
+    if backend is not None and not parseable(filename, backend):
+        return filename, size, mtime, 'unparseable'
+
+    return filename, size, mtime, None
+
+def quarantine(filename, quarantinedir='quarantine'):
+    """
+    Move the file out of the way to look at later. If a file with the same
+    name was quarantined before (e.g. the URL failed again), a number is
+    added, e.g. paper.1.pdf, rather than replacing it.
+    """
+    if not os.path.exists(quarantinedir):
+        os.makedirs(quarantinedir)
+
+    name, ext = os.path.splitext(os.path.basename(filename))
+    target = os.path.join(quarantinedir, name + ext)
+    i = 1
+
+    while os.path.exists(target):
+        target = os.path.join(quarantinedir, '%s.%d%s' % (name, i, ext))
+        i += 1
+
+    os.replace(filename, target)
+    return target
+
+def unverified(pdfdir, verified):
+    """
+    (filename, size, mtime) of the PDFs not verified since they last changed,
+    verified as returned by Manifest.verified()
+    """
+    files = []
+
+    for entry in (os.scandir(pdfdir) if os.path.exists(pdfdir) else []):
+        if entry.is_file() and entry.name.endswith('.pdf'):
+            stat = entry.stat()
+
+            if verified.get(entry.path) != (stat.st_size, stat.st_mtime_ns, verifyVersion):
+                files.append((entry.path, stat.st_size, stat.st_mtime_ns))
+
+    return files
+
+def verifyAll(pdfdir='pdfs', manifestFile='manifest.sqlite', parse=True,
+        processes=None, dryRun=False, quarantinedir='quarantine'):
+    """
+    Check the files not verified since they last changed. Returns (checked,
+    list of (filename, problem), URLs requeued, bad files that can't be
+    downloaded again since they're not in the manifest).
+    """
+    manifest = Manifest(manifestFile)
+    verified = manifest.verified()
+    sizes = dict((fname, size) for fname, (size, h) in manifest.hashes().items())
+    backend = parseBackend() if parse else None
+
+    toCheck = [(fname, size, mtime, sizes.get(fname), backend)
+        for fname, size, mtime in unverified(pdfdir, verified)]
+
+    good = []
+    bad = []
+
+    with Pool(processes) as pool:
+        for fname, size, mtime, problem in tqdm(pool.imap_unordered(checkFile,
+                toCheck, chunksize=16), total=len(toCheck)):
+            if problem is None:
+                good.append((fname, size, mtime, verifyVersion))
+            else:
+                bad.append((fname, problem))
+                metrics.inc('verify_failures_total', reason=problem)
+
+    requeued = 0
+    badFiles = [fname for fname, problem in bad]
+    known = manifest.downloaded(badFiles)
+    unknown = sorted(fname for fname in badFiles if fname not in known)
+
+    if not dryRun:
+        manifest.setVerified(good)
+
+        for fname in badFiles:
+            quarantine(fname, quarantinedir)
+
+        requeued = manifest.requeue(known)
+
+    manifest.close()
+
+    return len(toCheck), sorted(bad), requeued, unknown
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the downloaded PDFs and download bad ones again")
+    parser.add_argument('--no-parse', action='store_true',
+        help="only check the header, trailer, and size, not that it can be read")
+    parser.add_argument('--dry-run', action='store_true',
+        help="only print the bad files")
+    parser.add_argument('--processes', type=int, default=None,
+        help="files to check at once (default: number of cores)")
+    metrics.addArguments(parser)
+    args = parser.parse_args()
+
+    metrics.configure(args.metrics, args.profile)
+
+    with metrics.stage('verify') as stage:
+        checked, bad, requeued, unknown = verifyAll('pdfs', 'manifest.sqlite',
+            not args.no_parse, args.processes, args.dry_run)
+        stage.items = checked
+
+    for fname, problem in bad:
+        print("Bad (%s):" % problem, fname)
+
+    print("Checked:", checked, "Bad:", len(bad))
+
+    if not args.dry_run and bad:
+        print("Moved to quarantine/, URLs to download again:", requeued)
+
+    for fname in unknown:
+        print("Not in the manifest, can't download again:", fname)
+
+    metrics.save()